@@ -1,97 +1,165 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import logging
-import pandas as pd
 import os
 from datetime import datetime
 import json
 import re
+import time
+import asyncio
 
 # Import Google Sheets API client
 from services.google_sheets_service import GoogleSheetsService
-from llms.gemini_client import get_gemini_response
+from llms.gemini_client import get_gemini_response, get_gemini_response_shared
+from services.cache_service import LRUCache
+from processors.message_processor import normalize_message
+from processors import json_processor
 
 logger = logging.getLogger(__name__)
 
+# Precompiled patterns used on every extraction request
+_PHONE_RE = re.compile(r'(\+?\d{10,15}|\d{3}[-.\s]?\d{3}[-.\s]?\d{4})')
+_PHONE_CLEAN_RE = re.compile(r'[^0-9+]')
+
+# Cell values treated as "no data" when presenting an employee record
+_EMPTY_CELL_VALUES = frozenset({"", "nan", "none", "null"})
+
+# Joins a row's cells into one searchable string without letting matches span two cells
+_CELL_SEPARATOR = "\x1f"
+
+# How long (in seconds) a fetched sheet is reused before hitting the Sheets API again
+SHEET_CACHE_TTL = int(os.getenv("EMPLOYEE_SHEET_CACHE_TTL", "30"))
+
+SUB_INTENTS = ("extract_info", "update_info", "general_query")
+
+# Prompt templates - only the placeholders change between calls
+SUB_INTENT_PROMPT = """
+As an Employee Manager intent classifier, determine what action the user wants to perform.
+
+USER PROFILE:
+{profile}
+
+USER MESSAGE:
+{message}
+
+Based on the message, classify into EXACTLY ONE of these categories:
+- extract_info: User wants to retrieve information about an employee
+- update_info: User wants to update information about an employee
+- general_query: Any other employee-related query
+
+Your response should be ONLY the category name without any additional text.
+"""
+
+IDENTIFIER_PROMPT = """
+From this message, extract the employee identifier mentioned:
+
+MESSAGE: {message}
+
+If there's a name, extract the full name.
+If there's an employee ID, extract that.
+If there's an email, extract that.
+
+Return ONLY the extracted identifier without any additional text.
+"""
+
+UPDATE_DETAILS_PROMPT = """
+From this message, extract the employee identifier and the information to be updated:
+
+MESSAGE: {message}
+
+Format your response as a JSON object with these fields:
+- identifier: The employee identifier (phone number, name, or employee ID)
+- updates: A dictionary of fields to update with their new values
+
+Example: {{"identifier": "+1234567890", "updates": {{"Department": "Finance", "Position": "Senior Accountant"}}}}
+
+Return ONLY the JSON object without any additional text.
+"""
+
+GENERAL_QUERY_PROMPT = """
+You are an Employee Manager Assistant helping with HR queries.
+
+USER ROLE: {role}
+USER QUERY: {message}
+
+Respond to this query about employee management, keeping in mind:
+- If the user is not HR, be careful about sharing sensitive information
+- Give concise, professional responses
+- If you can't answer, suggest contacting HR
+
+Your response:
+"""
+
 class EmployeeManagerAgent:
     def __init__(self):
         self.sheets_service = GoogleSheetsService()
         self.spreadsheet_id = os.getenv("EMPLOYEE_SPREADSHEET_ID")
         self.sheet_name = os.getenv("EMPLOYEE_SHEET_NAME", "Employees")
+        # (spreadsheet_id, sheet_name) -> (fetched_at, header, rows, identifier index, lowercased row text)
+        self._sheet_cache = {}
+        # (normalized message, role) -> sub-intent, so repeated phrasings skip the LLM
+        self._intent_cache = LRUCache(maxsize=2048)
         logger.info("Employee Manager Agent initialized with Google Sheets connection")
     
     async def process(self, message: str, user_id: str, user_info: Dict, role: str, context: List) -> str:
         """Main method to process employee data related requests"""
         
+        # Resolve caller identity and permissions once for all downstream calls
+        llm_user_id = user_info.get("id", "unknown")
+        is_hr = role == "hr" or user_info.get("role") == "hr"
+        
         # Determine specific intent within employee manager domain
-        intent = await self._determine_sub_intent(message, user_info, context)
+        intent = await self._determine_sub_intent(message, user_info, llm_user_id, context)
         
         if intent == "extract_info":
-            return await self._extract_employee_info(message, user_info, role)
+            return await self._extract_employee_info(message, llm_user_id, is_hr)
         elif intent == "update_info":
-            return await self._update_employee_info(message, user_info, role)
+            return await self._update_employee_info(message, llm_user_id, is_hr)
         else:
-            return await self._handle_general_employee_query(message, user_info, role)
+            return await self._handle_general_employee_query(message, llm_user_id, role)
     
-    async def _determine_sub_intent(self, message: str, user_info: Dict, context: List) -> str:
+    async def _determine_sub_intent(self, message: str, user_info: Dict, llm_user_id: str, context: List) -> str:
         """Determine the specific intent within employee manager domain"""
         
-        prompt = f"""
-        As an Employee Manager intent classifier, determine what action the user wants to perform.
-        
-        USER PROFILE:
-        {json.dumps(user_info)}
-        
-        USER MESSAGE:
-        {message}
-        
-        Based on the message, classify into EXACTLY ONE of these categories:
-        - extract_info: User wants to retrieve information about an employee
-        - update_info: User wants to update information about an employee
-        - general_query: Any other employee-related query
+        cache_key = (normalize_message(message), user_info.get("role"))
+        intent = self._intent_cache.get(cache_key)
+        if intent:
+            logger.info(f"Employee Manager sub-intent cache hit: {intent}")
+            return intent
         
-        Your response should be ONLY the category name without any additional text.
-        """
+        prompt = SUB_INTENT_PROMPT.format(profile=json_processor.dumps(user_info), message=message)
         
         try:
-            response = await get_gemini_response(prompt, user_info.get("id", "unknown"), "system")
+            response = await get_gemini_response_shared(prompt, llm_user_id, "system")
             intent = response.strip().lower()
             logger.info(f"Employee Manager sub-intent determined as: {intent}")
+            # Only cache real classifications, never error text
+            if intent in SUB_INTENTS:
+                self._intent_cache.set(cache_key, intent)
             return intent
         except Exception as e:
             logger.error(f"Error determining employee manager sub-intent: {e}")
             return "general_query"
     
-    async def _extract_employee_info(self, message: str, user_info: Dict, role: str) -> str:
+    async def _extract_employee_info(self, message: str, llm_user_id: str, is_hr: bool) -> str:
         """Extract employee information based on phone number or other identifiers"""
         
         # Check if user has permission to access employee data
-        if role != "hr" and user_info.get("role") != "hr":
+        if not is_hr:
             return "I'm sorry, you don't have permission to access employee information. Please contact your HR department."
         
         try:
             # Extract phone number or other identifiers from the message
-            phone_pattern = r'(\+?\d{10,15}|\d{3}[-.\s]?\d{3}[-.\s]?\d{4})'
-            phone_match = re.search(phone_pattern, message)
+            phone_match = _PHONE_RE.search(message)
             
             if phone_match:
                 phone_number = phone_match.group(0)
                 # Clean up the phone number format
-                phone_number = re.sub(r'[^0-9+]', '', phone_number)
+                phone_number = _PHONE_CLEAN_RE.sub('', phone_number)
             else:
                 # Try to extract name or other identifiers
-                prompt = f"""
-                From this message, extract the employee identifier mentioned:
-                
-                MESSAGE: {message}
+                prompt = IDENTIFIER_PROMPT.format(message=message)
                 
-                If there's a name, extract the full name.
-                If there's an employee ID, extract that.
-                If there's an email, extract that.
-                
-                Return ONLY the extracted identifier without any additional text.
-                """
-                
-                identifier = await get_gemini_response(prompt, user_info.get("id", "unknown"), "system")
+                identifier = await get_gemini_response(prompt, llm_user_id, "system")
                 identifier = identifier.strip()
                 
                 if not identifier or identifier.lower() == "none":
@@ -104,42 +172,27 @@ class EmployeeManagerAgent:
                 return f"I couldn't find any employee matching: {phone_number if phone_match else identifier}"
             
             # Format the response
-            response = f"Employee Information:\n\n"
-            for key, value in employee_data.items():
-                if key and value and value != "nan":
-                    response += f"{key}: {value}\n"
-            
-            return response
+            lines = ["Employee Information:", ""]
+            lines.extend(f"{key}: {value}" for key, value in employee_data.items())
+            return "\n".join(lines) + "\n"
         
         except Exception as e:
             logger.error(f"Error extracting employee info: {e}")
             return "Sorry, I encountered an error while retrieving employee information. Please try again later."
     
-    async def _update_employee_info(self, message: str, user_info: Dict, role: str) -> str:
+    async def _update_employee_info(self, message: str, llm_user_id: str, is_hr: bool) -> str:
         """Update employee information in the Google Spreadsheet"""
         
         # Check if user has permission to update employee data
-        if role != "hr" and user_info.get("role") != "hr":
+        if not is_hr:
             return "I'm sorry, you don't have permission to update employee information. Please contact your HR department."
         
         try:
             # Extract update details from the message
-            prompt = f"""
-            From this message, extract the employee identifier and the information to be updated:
+            prompt = UPDATE_DETAILS_PROMPT.format(message=message)
             
-            MESSAGE: {message}
-            
-            Format your response as a JSON object with these fields:
-            - identifier: The employee identifier (phone number, name, or employee ID)
-            - updates: A dictionary of fields to update with their new values
-            
-            Example: {{"identifier": "+1234567890", "updates": {{"Department": "Finance", "Position": "Senior Accountant"}}}}
-            
-            Return ONLY the JSON object without any additional text.
-            """
-            
-            update_details_str = await get_gemini_response(prompt, user_info.get("id", "unknown"), "system")
-            update_details = json.loads(update_details_str)
+            update_details_str = await get_gemini_response(prompt, llm_user_id, "system")
+            update_details = json_processor.extract_json(update_details_str)
             
             identifier = update_details.get("identifier")
             updates = update_details.get("updates", {})
@@ -156,60 +209,144 @@ class EmployeeManagerAgent:
             else:
                 return f"I couldn't find any employee matching: {identifier}"
         
+        except json.JSONDecodeError:
+            logger.error(f"Failed to parse update details JSON: {update_details_str}")
+            return "I couldn't identify which employee to update or what information to update. Please provide more details."
+        
         except Exception as e:
             logger.error(f"Error updating employee info: {e}")
             return "Sorry, I encountered an error while updating employee information. Please try again later."
     
-    async def _handle_general_employee_query(self, message: str, user_info: Dict, role: str) -> str:
+    async def _handle_general_employee_query(self, message: str, llm_user_id: str, role: str) -> str:
         """Handle general employee-related queries"""
         
-        prompt = f"""
-        You are an Employee Manager Assistant helping with HR queries.
-        
-        USER ROLE: {role}
-        USER QUERY: {message}
-        
-        Respond to this query about employee management, keeping in mind:
-        - If the user is not HR, be careful about sharing sensitive information
-        - Give concise, professional responses
-        - If you can't answer, suggest contacting HR
-        
-        Your response:
-        """
+        prompt = GENERAL_QUERY_PROMPT.format(role=role, message=message)
         
         try:
-            response = await get_gemini_response(prompt, user_info.get("id", "unknown"), "system")
+            response = await get_gemini_response_shared(prompt, llm_user_id, "system")
             return response
         except Exception as e:
             logger.error(f"Error handling general employee query: {e}")
             return "I'm having trouble processing your request. Please try again later or contact your HR department."
     
+    async def _load(self) -> Tuple[List[str], List[List[str]], Dict[str, int], List[str]]:
+        """
+        Return (header, rows, identifier index, lowercased row text) for the employee sheet
+        
+        Retrieval and updates both go through here, so a lookup followed by an update
+        within the TTL costs a single Sheets API call.
+        """
+        
+        key = (self.spreadsheet_id, self.sheet_name)
+        cached = self._sheet_cache.get(key)
+        if cached and time.monotonic() - cached[0] < SHEET_CACHE_TTL:
+            return cached[1:]
+        
+        sheet_data = await self.sheets_service.get_sheet_data(self.spreadsheet_id, self.sheet_name)
+        header, rows = sheet_data[0], sheet_data[1:]
+        index = self._build_row_index(header, rows)
+        # Each row stringified and lowercased once, so substring searches need no per-cell conversion
+        row_text = [_CELL_SEPARATOR.join(map(str, row)).lower() for row in rows]
+        self._sheet_cache[key] = (time.monotonic(), header, rows, index, row_text)
+        return header, rows, index, row_text
+    
+    def _invalidate_sheet_cache(self) -> None:
+        """Drop the cached employee sheet so the next read fetches fresh data"""
+        self._sheet_cache.pop((self.spreadsheet_id, self.sheet_name), None)
+    
+    @staticmethod
+    def _normalize_identifier(value) -> str:
+        """Lowercase and collapse whitespace so identifiers compare consistently"""
+        return " ".join(str(value).split()).lower()
+    
+    @staticmethod
+    def _search_columns(header: List[str]) -> List[int]:
+        """Column positions in the order identifiers are matched: phone column B first, then left to right"""
+        columns = list(range(len(header)))
+        if len(columns) > 1:
+            columns.insert(0, columns.pop(1))
+        return columns
+    
+    def _build_row_index(self, header: List[str], rows: List[List[str]]) -> List[Dict[str, int]]:
+        """One exact-match index per column, in search order, mapping each cell value to the first row containing it"""
+        
+        index = []
+        for col in self._search_columns(header):
+            column_index = {}
+            for row_pos, row in enumerate(rows):
+                if col >= len(row) or not row[col]:
+                    continue
+                column_index.setdefault(self._normalize_identifier(row[col]), row_pos)
+                # Phone numbers (column B) are also indexed in the cleaned form used by extraction
+                if col == 1:
+                    phone = _PHONE_CLEAN_RE.sub('', str(row[col]))
+                    if phone:
+                        column_index.setdefault(phone, row_pos)
+            index.append(column_index)
+        
+        return index
+    
+    def _find_matching_row(self, header: List[str], rows: List[List[str]], index: List[Dict[str, int]],
+                           row_text: List[str], identifier: str) -> Optional[int]:
+        """Return the position of the first row matching the identifier, preferring the phone column"""
+        
+        # Exact matches are answered from the per-column indexes built when the sheet was loaded,
+        # checked in the same column order as the substring search below
+        key = self._normalize_identifier(identifier)
+        for column_index in index:
+            row_pos = column_index.get(key)
+            if row_pos is not None:
+                return row_pos
+        
+        # Fall back to a substring search: one pass over the prebuilt row text finds candidate rows,
+        # then only those rows are checked cell by cell (phone column B first, then in column order)
+        needle = identifier.lower()
+        candidates = [row_pos for row_pos, text in enumerate(row_text) if needle in text]
+        if not candidates:
+            return None
+        
+        for col in self._search_columns(header):
+            for row_pos in candidates:
+                row = rows[row_pos]
+                if col < len(row) and needle in str(row[col]).lower():
+                    return row_pos
+        
+        return None
+    
+    @staticmethod
+    def _populated_fields(pairs) -> Dict:
+        """Build a record from (column, value) pairs, dropping unnamed columns and empty or placeholder values"""
+        return {
+            key: value for key, value in pairs
+            if key and value is not None and str(value).strip().lower() not in _EMPTY_CELL_VALUES
+        }
+    
     async def _retrieve_employee_data(self, identifier: str) -> Dict:
         """Retrieve employee data from Google Sheets based on identifier"""
         
         try:
-            # Get all employee data from Google Sheets
-            sheet_data = await self.sheets_service.get_sheet_data(self.spreadsheet_id, self.sheet_name)
-            
-            # Convert to DataFrame for easier manipulation
-            df = pd.DataFrame(sheet_data[1:], columns=sheet_data[0])
+            # With no cached sheet, look phone numbers up in the phone column (B) only
+            # instead of downloading every row
+            cached = (self.spreadsheet_id, self.sheet_name) in self._sheet_cache
+            if not cached and _PHONE_RE.fullmatch(identifier):
+                employee_data = await self.sheets_service.find_row(
+                    self.spreadsheet_id,
+                    self.sheet_name,
+                    "B",
+                    lambda cell: _PHONE_CLEAN_RE.sub('', cell) == identifier
+                )
+                if employee_data:
+                    return self._populated_fields(employee_data.items())
             
-            # Try to match by phone number (column B) first
-            matched_row = df[df.iloc[:, 1].str.contains(identifier, case=False, na=False)]
+            # Get all employee data from Google Sheets (cached for a short TTL)
+            header, rows, index, row_text = await self._load()
             
-            # If no match, try other columns
-            if matched_row.empty:
-                for col in df.columns:
-                    matched_row = df[df[col].astype(str).str.contains(identifier, case=False, na=False)]
-                    if not matched_row.empty:
-                        break
-            
-            if matched_row.empty:
+            row_pos = self._find_matching_row(header, rows, index, row_text, identifier)
+            if row_pos is None:
                 return {}
             
-            # Convert first matched row to dictionary
-            employee_data = matched_row.iloc[0].to_dict()
-            return employee_data
+            # Convert first matched row to dictionary, keeping only populated fields
+            return self._populated_fields(zip(header, rows[row_pos]))
         
         except Exception as e:
             logger.error(f"Error retrieving employee data: {e}")
@@ -219,43 +356,40 @@ class EmployeeManagerAgent:
         """Update employee data in Google Sheets"""
         
         try:
-            # Get all employee data from Google Sheets
-            sheet_data = await self.sheets_service.get_sheet_data(self.spreadsheet_id, self.sheet_name)
-            
-            # Convert to DataFrame for easier manipulation
-            df = pd.DataFrame(sheet_data[1:], columns=sheet_data[0])
+            # Get all employee data from Google Sheets (cached for a short TTL)
+            header, rows, index, row_text = await self._load()
             
             # Try to find the row to update
-            row_idx = -1
-            
-            # Try to match by phone number (column B) first
-            matched_rows = df[df.iloc[:, 1].str.contains(identifier, case=False, na=False)]
-            
-            # If no match, try other columns
-            if matched_rows.empty:
-                for col in df.columns:
-                    matched_rows = df[df[col].astype(str).str.contains(identifier, case=False, na=False)]
-                    if not matched_rows.empty:
-                        break
-            
-            if matched_rows.empty:
+            row_pos = self._find_matching_row(header, rows, index, row_text, identifier)
+            if row_pos is None:
                 return False
             
             # Get the row index (adding 2 to account for 0-indexing and header row)
-            row_idx = matched_rows.index[0] + 2
+            row_idx = row_pos + 2
             
-            # Update the cell values
+            # Collect the cell values, then write them in one request
+            cells = []
             for field, value in updates.items():
-                if field in df.columns:
-                    col_idx = df.columns.get_loc(field) + 1  # +1 for 1-indexing in Sheets API
-                    await self.sheets_service.update_cell(
-                        self.spreadsheet_id,
-                        self.sheet_name,
-                        row_idx,
-                        col_idx,
-                        value
-                    )
+                if field in header:
+                    col_idx = header.index(field) + 1  # +1 for 1-indexing in Sheets API
+                    cells.append((row_idx, col_idx, value))
+            
+            if not await self.sheets_service.batch_update_cells(self.spreadsheet_id, self.sheet_name, cells):
+                # Batch endpoint failed - fall back to per-cell updates issued concurrently
+                logger.warning("Batch update failed, falling back to concurrent per-cell updates")
+                results = await asyncio.gather(
+                    *[
+                        self.sheets_service.update_cell(self.spreadsheet_id, self.sheet_name, row, col, value)
+                        for row, col, value in cells
+                    ],
+                    return_exceptions=True
+                )
+                if any(result is not True for result in results):
+                    self._invalidate_sheet_cache()
+                    return False
             
+            # The sheet changed, so the cached copy is no longer valid
+            self._invalidate_sheet_cache()
             return True
         
         except Exception as e:
@@ -1,11 +1,35 @@
-from typing import Dict
+from typing import Dict, Optional
 import logging
-import json
+import re
 
 from llms.gemini_client import get_gemini_response
+from processors import json_processor
 
 logger = logging.getLogger(__name__)
 
+# Prompt template - only the placeholders change between calls
+HR_RESPONSE_PROMPT = """
+You are an HR Assistant for a company. Respond to the following query from an employee.
+
+USER INFORMATION:
+Role: {role}
+Name: {name}
+
+RECENT CONVERSATION:
+{context_text}
+
+CURRENT QUERY:
+{message}
+
+Provide a helpful, concise response. If you don't have specific information on a company policy,
+give general HR best practices but make it clear that the employee should confirm with their HR department.
+
+For sensitive or complex HR issues (like harassment, compensation disputes, termination), advise the 
+employee to contact HR directly rather than providing specific guidance.
+
+Your response:
+"""
+
 class GeneralHRAgent:
     def __init__(self):
         logger.info("General HR Agent initialized")
@@ -16,14 +40,32 @@ class GeneralHRAgent:
             "work_from_home": "Employees may work from home up to 2 days per week with manager approval.",
             "benefits": "Health insurance, retirement plan, and annual bonuses are available for all full-time employees.",
         }
+        # policy phrase -> policy text, with every phrase compiled into one alternation so a lookup is a single pass
+        self._policy_lookup = {policy.replace("_", " "): info for policy, info in self.hr_policies.items()}
+        self._policy_re = re.compile("|".join(map(re.escape, self._policy_lookup)))
+        
+        self.faqs = {
+            "how do i apply for leave": "You can apply for leave through our HRMS portal. Go to the 'Leave Management' section and click on 'Apply for Leave'.",
+            "what is the probation period": "The standard probation period is 3 months from your date of joining.",
+            "how many sick days do i get": "Full-time employees receive 10 paid sick days per year.",
+            "when are performance reviews": "Performance reviews are conducted bi-annually in June and December.",
+            "how do i submit expenses": "Submit your expenses through the Finance portal with relevant receipts within 30 days of incurring them."
+        }
+        # All FAQ questions compiled into one alternation so a lookup is a single pass over the question
+        self._faq_re = re.compile("|".join(map(re.escape, self.faqs)))
     
-    async def process(self, message: str, user_id: str, user_info: Dict, role: str, context: str) -> str:
+    async def process(self, message: str, user_id: str, user_info: Dict, role: str, context: str,
+                      draft_response: Optional[str] = None) -> str:
         """Process general HR related queries (expects context as JSON string)"""
         
         # Check if message mentions any of the predefined policies
-        for policy, info in self.hr_policies.items():
-            if policy.replace("_", " ") in message.lower():
-                return f"Policy on {policy.replace('_', ' ')}: {info}"
+        match = self._policy_re.search(message.lower())
+        if match:
+            return f"Policy on {match.group(0)}: {self._policy_lookup[match.group(0)]}"
+        
+        # The orchestrator's intent call may already have drafted the answer
+        if draft_response:
+            return draft_response
         
         # For other queries, use LLM to generate a response
         return await self._generate_hr_response(message, user_info, role, context)
@@ -33,7 +75,7 @@ class GeneralHRAgent:
         
         # Convert string context to list of dicts
         try:
-            context_list = json.loads(context) if context else []
+            context_list = json_processor.loads(context) if context else []
         except Exception as e:
             logger.warning(f"Context deserialization failed: {e}")
             context_list = []
@@ -41,27 +83,12 @@ class GeneralHRAgent:
         recent_context = context_list[-3:] if context_list else []
         context_text = "\n".join([f"{item['role']}: {item['content']}" for item in recent_context]) if recent_context else "No recent context"
         
-        prompt = f"""
-        You are an HR Assistant for a company. Respond to the following query from an employee.
-
-        USER INFORMATION:
-        Role: {role}
-        Name: {user_info.get('name', 'Employee')}
-
-        RECENT CONVERSATION:
-        {context_text}
-
-        CURRENT QUERY:
-        {message}
-
-        Provide a helpful, concise response. If you don't have specific information on a company policy,
-        give general HR best practices but make it clear that the employee should confirm with their HR department.
-
-        For sensitive or complex HR issues (like harassment, compensation disputes, termination), advise the 
-        employee to contact HR directly rather than providing specific guidance.
-
-        Your response:
-        """
+        prompt = HR_RESPONSE_PROMPT.format(
+            role=role,
+            name=user_info.get('name', 'Employee'),
+            context_text=context_text,
+            message=message
+        )
         
         try:
             response = await get_gemini_response(prompt, user_info.get("id", "unknown"), "system")
@@ -73,17 +100,8 @@ class GeneralHRAgent:
     async def handle_faq(self, question: str) -> str:
         """Handle frequently asked HR questions"""
         
-        faqs = {
-            "how do i apply for leave": "You can apply for leave through our HRMS portal. Go to the 'Leave Management' section and click on 'Apply for Leave'.",
-            "what is the probation period": "The standard probation period is 3 months from your date of joining.",
-            "how many sick days do i get": "Full-time employees receive 10 paid sick days per year.",
-            "when are performance reviews": "Performance reviews are conducted bi-annually in June and December.",
-            "how do i submit expenses": "Submit your expenses through the Finance portal with relevant receipts within 30 days of incurring them."
-        }
-        
-        question_lower = question.lower()
-        for faq_q, faq_a in faqs.items():
-            if faq_q in question_lower:
-                return faq_a
+        match = self._faq_re.search(question.lower())
+        if match:
+            return self.faqs[match.group(0)]
         
         return None  # No matching FAQ
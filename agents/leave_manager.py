@@ -1,16 +1,227 @@
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Type
 import logging
+import asyncio
+import calendar
 import json
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import re
+import textwrap
+from itertools import groupby
 
-from llms.gemini_client import get_gemini_response
+from llms.gemini_client import GEMINI_ERROR_RESPONSE, get_gemini_response, response_schema_for
+from pydantic import BaseModel, ValidationError
 from services.gsuite_service import update_gsuite_resources
-from database.pgDb import SessionLocal
+from sqlalchemy import and_, func, update
+from sqlalchemy.orm import joinedload, selectinload
+
+from database.pgDb import run_in_session
 from models.models import LeaveRequest, User
+from models.schemas import (
+    ApprovalExtraction, CancelExtraction, DateRangeExtraction,
+    LeaveExtraction, ListExtraction, ReportExtraction
+)
+from services.cache_service import LRUCache
+from services.leave_balance_service import (
+    LEAVE_DAYS, adjust_leave_balance, adjust_leave_balances, get_used_by_type
+)
+from processors.message_processor import normalize_message
+from processors.json_processor import json_block
+from processors.date_processor import parse_date_range
 
 logger = logging.getLogger(__name__)
 
+LEAVE_ACTIONS = ("request", "approval", "balance", "cancel", "list", "general")
+
+# Classifier category descriptions; approval is only offered to roles allowed to approve
+ACTION_DESCRIPTIONS = {
+    "request": "User wants to apply for leave",
+    "approval": "User wants to approve or reject someone's leave",
+    "balance": "User is asking about leave balance or entitlement",
+    "cancel": "User wants to cancel an existing leave request",
+    "list": "User wants to see pending or approved leaves",
+    "general": "General questions about leave policy or other leave-related queries"
+}
+APPROVER_ROLES = ("hr", "manager")
+
+# Deterministic rules for commands that open with an unambiguous imperative, checked in order before
+# asking the LLM classifier. Questions ("Can I take leave during probation?") always go to the classifier
+ACTION_RULES = [
+    (re.compile(r"^(please\s+)?(show|check|get)\s+(me\s+)?my\s+(leave\s+)?balance\b", re.I), "balance"),
+    (re.compile(r"^(please\s+)?(approve|reject)\b", re.I), "approval"),
+    (re.compile(r"^(please\s+)?(cancel|withdraw)\s+(my\s+)?(leave|request|#)", re.I), "cancel"),
+    (re.compile(r"^(please\s+)?(apply\s+for|book)\b.*\bleave\b", re.I), "request"),
+    (re.compile(r"^(please\s+)?(list|show)\s+(me\s+)?(my|all|pending|approved)\b.*\bleaves?\b", re.I), "list"),
+]
+
+# "approve #42" / "#42 reject" and "cancel #42" style messages that need no LLM extraction
+DECISION_VERB_RE = re.compile(r"\b(approve|reject)\b", re.I)
+EXPLICIT_REQUEST_ID_RE = re.compile(r"#\s*(\d+)")
+# Any negation makes a command ambiguous ("don't approve #42, reject it"), so those go to the LLM
+NEGATION_RE = re.compile(r"\b(not|no|never)\b|n't\b", re.I)
+
+# (role, normalized message) -> leave action, so repeated phrasings skip the LLM classifier
+_action_cache = LRUCache(maxsize=1000)
+
+# Static company leave policy; kept at the front of the prompt so the prefix is identical across queries
+LEAVE_POLICY = """
+        Company leave policies:
+        - Annual leave: 20 days per year, accruing monthly
+        - Sick leave: 10 days per year, requires doctor's note for 3+ consecutive days
+        - Personal leave: 5 days per year for personal matters
+        - Bereavement leave: Up to 5 days for immediate family
+        - Parental leave: 12 weeks for primary caregiver, 4 weeks for secondary
+        - Unpaid leave: Considered on case-by-case basis after paid leave is exhausted
+        - Leave requests should be submitted at least 2 weeks in advance except for emergencies
+        - All leave requests require manager approval
+        - Carryover policy: Up to 5 days of annual leave can be carried over to next year
+"""
+
+# (role, normalized question) -> policy answer; the policy is static so answers only depend on these
+_policy_answer_cache = LRUCache(maxsize=512, ttl=24 * 60 * 60)
+
+# (manager id, start, end) -> team calendar entries; short TTL so approvals show up within a minute
+_team_calendar_cache = LRUCache(maxsize=256, ttl=60)
+_NOT_CACHED = object()
+
+# normalized message -> extracted report parameters; time frames stay as text, so these never go stale
+_report_params_cache = LRUCache(maxsize=1024)
+
+STATUS_EMOJI = {
+    "pending": "⏳",
+    "approved": "✅",
+    "rejected": "❌",
+    "cancelled": "🚫"
+}
+
+BALANCE_TEMPLATE = textwrap.dedent("""\
+    Here's your current leave balance for {year}:
+
+    Annual Leave: {annual_left} days remaining (used {annual_used} of {annual_balance})
+    Sick Leave: {sick_left} days remaining (used {sick_used} of {sick_balance})
+    Personal Leave: {personal_left} days remaining (used {personal_used} of {personal_balance})""")
+
+# lowercased employee name -> (user id, username); saves an unindexable ILIKE '%name%' scan on repeat lookups
+_employee_cache = LRUCache(maxsize=512, ttl=300)
+
+# Gemini response schemas for each extraction prompt, built once
+LEAVE_SCHEMA = response_schema_for(LeaveExtraction)
+APPROVAL_SCHEMA = response_schema_for(ApprovalExtraction)
+CANCEL_SCHEMA = response_schema_for(CancelExtraction)
+LIST_SCHEMA = response_schema_for(ListExtraction)
+REPORT_SCHEMA = response_schema_for(ReportExtraction)
+DATE_RANGE_SCHEMA = response_schema_for(DateRangeExtraction)
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-flight
+_background_tasks = set()
+
+def _run_in_background(coro) -> None:
+    """Schedule coro without awaiting it, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _approval_task_result(leave_id: int, employee_id: int, employee_name: str, leave_type: str,
+                          start_date: datetime, end_date: datetime) -> Dict:
+    """The leave_approval task result update_gsuite_resources acts on (calendar event, tracking sheet, email)"""
+    return {
+        "success": True,
+        "task_type": "leave_approval",
+        "details": {
+            "leave_id": leave_id,
+            "employee_id": employee_id,
+            "employee_name": employee_name,
+            "leave_type": leave_type,
+            # Calendar all-day events take bare dates
+            "start_date": start_date.date().isoformat(),
+            "end_date": end_date.date().isoformat(),
+            "calendar_update_required": True
+        }
+    }
+
+async def _sync_calendar(task_result: Dict) -> None:
+    """
+    Background task pushing a committed approval to Google Workspace
+    
+    Not retried: the event insert, sheet append and email aren't idempotent, so a retry after a
+    partial success would duplicate them.
+    """
+    if not await update_gsuite_resources(task_result):
+        logger.error(f"Google Workspace update for leave #{task_result['details']['leave_id']} failed")
+
+# Upper bound on a single Gemini call made by this agent, so one stuck call can't stall a request
+LLM_TIMEOUT_SECONDS = 30
+
+def _resolve_employee(db, name: str) -> Optional[Tuple[int, str]]:
+    """Find the first user whose username contains name, returning (id, username) or None"""
+    key = name.strip().lower()
+    cached = _employee_cache.get(key)
+    if cached:
+        return cached
+    
+    employee = db.query(User.id, User.username).filter(User.username.ilike(f"%{key}%")).first()
+    if not employee:
+        return None
+    
+    # Only hits are cached, so newly added employees are found straight away
+    resolved = (employee.id, employee.username)
+    _employee_cache.set(key, resolved)
+    return resolved
+
+def _day_text(days) -> str:
+    """'1 day' / 'n days'"""
+    return f"{days} day{'s' if days != 1 else ''}"
+
+def _parse_iso_date(value: Optional[str]) -> Optional[date]:
+    """Parse a YYYY-MM-DD string from the LLM, returning None if it's missing or malformed"""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        logger.warning(f"Ignoring malformed date from extraction: {value!r}")
+        return None
+
+def _explicit_request_id(message: str) -> Optional[int]:
+    """The request ID of an unambiguous '#42' style command: exactly one ID and no negation"""
+    ids = EXPLICIT_REQUEST_ID_RE.findall(message)
+    if len(ids) != 1 or NEGATION_RE.search(message):
+        return None
+    return int(ids[0])
+
+def _explicit_decision(message: str) -> Optional[Dict]:
+    """Approval details for an unambiguous 'approve #42' style command: a single decision verb and request ID"""
+    verbs = DECISION_VERB_RE.findall(message)
+    request_id = _explicit_request_id(message)
+    if len(verbs) != 1 or request_id is None:
+        return None
+    return {"request_id": request_id, "decision": verbs[0].lower()}
+
+def _explicit_batch_approval(message: str) -> Optional[List[int]]:
+    """Request IDs of an unambiguous 'approve #41, #42 and #43' command: the only verb is approve, no negation"""
+    ids = EXPLICIT_REQUEST_ID_RE.findall(message)
+    verbs = DECISION_VERB_RE.findall(message)
+    if len(ids) < 2 or len(verbs) != 1 or verbs[0].lower() != "approve" or NEGATION_RE.search(message):
+        return None
+    return list(dict.fromkeys(int(request_id) for request_id in ids))
+
+def _parse_extraction(result: str, schema: Type[BaseModel]) -> Dict:
+    """Validate a structured Gemini response and return the fields it actually filled in"""
+    # Schema mode normally returns bare JSON; trimming any ```json fence first avoids a failed parse
+    return schema.model_validate_json(json_block(result)).model_dump(exclude_none=True)
+
+async def _resolve_date_range(description: str, fallback_prompt: str, user_id: str) -> Dict:
+    """Resolve a date description to start/end dates locally, asking Gemini only when that fails"""
+    resolved = parse_date_range(description)
+    if resolved:
+        return {"start_date": resolved[0].isoformat(), "end_date": resolved[1].isoformat()}
+    
+    logger.info(f"Falling back to Gemini to parse dates from: {description[:50]}")
+    result = await asyncio.wait_for(
+        get_gemini_response(fallback_prompt, user_id, "system", response_schema=DATE_RANGE_SCHEMA),
+        LLM_TIMEOUT_SECONDS
+    )
+    return _parse_extraction(result, DateRangeExtraction)
+
 class LeaveManagerAgent:
     """Agent responsible for handling all leave-related requests and operations"""
     
@@ -38,6 +249,24 @@ class LeaveManagerAgent:
     async def _determine_leave_action(self, message: str, user_info: Dict, role: str) -> str:
         """Determine what kind of leave action is needed"""
         
+        cache_key = (role, normalize_message(message))
+        action = _action_cache.get(cache_key)
+        if action:
+            logger.info(f"Leave action cache hit '{action}' for message: {message[:50]}...")
+            return action
+        
+        categories = [action for action in LEAVE_ACTIONS if action != "approval" or role in APPROVER_ROLES]
+        
+        # Questions always go to the classifier
+        if "?" not in message:
+            for pattern, rule_action in ACTION_RULES:
+                if pattern.search(message.strip()):
+                    if rule_action not in categories:
+                        rule_action = "general"
+                    logger.info(f"Leave action matched rule '{rule_action}' for message: {message[:50]}...")
+                    return rule_action
+        
+        category_lines = "\n        ".join(f"- {action}: {ACTION_DESCRIPTIONS[action]}" for action in categories)
         prompt = f"""
         As a leave management classifier, determine what type of leave action is being requested in this message:
         
@@ -45,12 +274,7 @@ class LeaveManagerAgent:
         MESSAGE: {message}
         
         Classify into exactly ONE of these categories:
-        - request: User wants to apply for leave
-        - approval: User wants to approve someone's leave (if they're HR/manager)
-        - balance: User is asking about leave balance or entitlement
-        - cancel: User wants to cancel an existing leave request
-        - list: User wants to see pending or approved leaves
-        - general: General questions about leave policy or other leave-related queries
+        {category_lines}
         
         Respond with ONLY the category name without any explanation.
         """
@@ -58,9 +282,9 @@ class LeaveManagerAgent:
         action = await get_gemini_response(prompt, user_info.get("id", "unknown"), "system")
         action = action.strip().lower()
         
-        # Force to general if role doesn't have approval permission
-        if action == "approval" and role not in ["hr", "manager"]:
-            action = "general"
+        # Only the classification is cached - never the downstream database changes
+        if action in categories:
+            _action_cache.set(cache_key, action)
             
         logger.info(f"Leave action determined as '{action}' for message: {message[:50]}...")
         return action
@@ -79,23 +303,25 @@ class LeaveManagerAgent:
         - start_date: (YYYY-MM-DD format)
         - end_date: (YYYY-MM-DD format)
         - reason: (brief reason for leave)
-        - half_day: (true if half day requested, false otherwise)
         
         If any information is missing, use null for that field.
         Return ONLY the JSON object without explanation.
         """
         
         try:
-            extraction_result = await get_gemini_response(extraction_prompt, user_id, "system")
-            leave_details = json.loads(extraction_result)
+            extraction_result = await get_gemini_response(extraction_prompt, user_id, "system", response_schema=LEAVE_SCHEMA)
+            leave_details = _parse_extraction(extraction_result, LeaveExtraction)
+            
+            # Validate the extracted information; unreadable dates count as missing
+            leave_details["start_date"] = _parse_iso_date(leave_details.get("start_date"))
+            leave_details["end_date"] = _parse_iso_date(leave_details.get("end_date"))
             
-            # Validate the extracted information
             missing_fields = []
             if not leave_details.get("leave_type"):
                 missing_fields.append("leave type")
-            if not leave_details.get("start_date"):
+            if not leave_details["start_date"]:
                 missing_fields.append("start date")
-            if not leave_details.get("end_date"):
+            if not leave_details["end_date"]:
                 missing_fields.append("end date")
                 
             # If critical information is missing, ask for clarification
@@ -104,40 +330,15 @@ class LeaveManagerAgent:
                 return f"I'd be happy to process your leave request, but I need a few more details. Could you please provide the {missing_info}?"
             
             # Save the leave request to the database
-            db = SessionLocal()
-            try:
-                user = db.query(User).filter(User.id == user_info.get("id")).first()
-                if not user:
-                    return "I couldn't find your user profile in our system. Please contact HR for assistance."
-                
-                leave_request = LeaveRequest(
-                    user_id=user.id,
-                    leave_type=leave_details["leave_type"],
-                    start_date=datetime.strptime(leave_details["start_date"], "%Y-%m-%d").date(),
-                    end_date=datetime.strptime(leave_details["end_date"], "%Y-%m-%d").date(),
-                    reason=leave_details.get("reason", "Not specified"),
-                    status="pending",
-                    half_day=leave_details.get("half_day", False)
-                )
-                
-                db.add(leave_request)
-                db.commit()
-                
-                # Calculate the number of days
-                delta = leave_request.end_date - leave_request.start_date
-                days = delta.days + 1
-                if leave_request.half_day:
-                    days = days - 0.5
-                
-                # Notify the user's manager
-                # self._notify_manager(user.manager_id, leave_request)
-                
-                return f"Your leave request has been submitted successfully!\n\nDetails:\n- Type: {leave_request.leave_type.capitalize()}\n- From: {leave_request.start_date}\n- To: {leave_request.end_date}\n- Duration: {days} day(s)\n\nYour request is pending approval. I'll notify you once it's approved."
-                
-            finally:
-                db.close()
+            response, notification = await run_in_session(self._save_leave_request, user_info.get("id"), leave_details)
+            
+            # Notify the manager in the background once the request is committed
+            if notification:
+                _run_in_background(self._notify_manager(notification))
+            
+            return response
                 
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValidationError):
             logger.error(f"Failed to parse leave details JSON: {extraction_result}")
             return "I'm having trouble understanding your leave request. Could you please provide your leave details in a clearer format? For example: 'I want to take annual leave from May 15 to May 18 for a family vacation.'"
         
@@ -145,6 +346,45 @@ class LeaveManagerAgent:
             logger.error(f"Error processing leave request: {str(e)}")
             return "I encountered an error while processing your leave request. Please try again or contact HR directly."
     
+    def _save_leave_request(self, db, user_db_id, leave_details: Dict) -> Tuple[str, Optional[Dict]]:
+        """Store a new pending leave request; returns the confirmation and the manager notification to send"""
+        # Load the manager with the user so the notification needs no further queries
+        user = db.get(User, user_db_id, options=[joinedload(User.manager)])
+        if not user:
+            return "I couldn't find your user profile in our system. Please contact HR for assistance.", None
+        
+        leave_request = LeaveRequest(
+            employee_id=user.id,
+            leave_type=leave_details["leave_type"],
+            start_date=leave_details["start_date"],
+            end_date=leave_details["end_date"],
+            reason=leave_details.get("reason", "Not specified"),
+            status="pending"
+        )
+        
+        db.add(leave_request)
+        db.commit()
+        
+        # Calculate the number of days
+        delta = leave_request.end_date - leave_request.start_date
+        days = delta.days + 1
+        
+        # Snapshot what the manager notification needs as plain values, since it runs after the session closes
+        notification = None
+        if user.manager:
+            notification = {
+                "manager_id": user.manager.id,
+                "manager_name": user.manager.username,
+                "employee_name": user.username,
+                "leave_type": leave_request.leave_type,
+                "start_date": leave_request.start_date,
+                "end_date": leave_request.end_date,
+                "days": days,
+                "reason": leave_request.reason
+            }
+        
+        return f"Your leave request has been submitted successfully!\n\nDetails:\n- Type: {leave_request.leave_type.capitalize()}\n- From: {leave_request.start_date}\n- To: {leave_request.end_date}\n- Duration: {days} day(s)\n\nYour request is pending approval. I'll notify you once it's approved.", notification
+    
     async def _handle_leave_approval(self, message: str, user_id: str, user_info: Dict, role: str) -> str:
         """Handle approval of leave requests (for HR and managers)"""
         
@@ -168,79 +408,27 @@ class LeaveManagerAgent:
         """
         
         try:
-            extraction_result = await get_gemini_response(approval_prompt, user_id, "system")
-            approval_details = json.loads(extraction_result)
+            # Several IDs approved in one message go through a single batch UPDATE
+            batch_ids = _explicit_batch_approval(message)
+            if batch_ids:
+                approved_ids = await self.approve_many(batch_ids, user_info.get("id"))
+                return self._batch_approval_reply(batch_ids, approved_ids)
             
-            db = SessionLocal()
-            try:
-                # Try to find the leave request
-                query = db.query(LeaveRequest).filter(LeaveRequest.status == "pending")
-                
-                if approval_details.get("request_id"):
-                    query = query.filter(LeaveRequest.id == approval_details["request_id"])
-                    
-                if approval_details.get("employee_name"):
-                    employee = db.query(User).filter(User.username.ilike(f"%{approval_details['employee_name']}%")).first()
-                    if employee:
-                        query = query.filter(LeaveRequest.user_id == employee.id)
-                    else:
-                        return f"I couldn't find an employee named '{approval_details['employee_name']}' in our system."
-                
-                # If there's still ambiguity
-                leave_requests = query.all()
-                
-                if not leave_requests:
-                    return "I couldn't find any pending leave requests matching your criteria. Please specify which request you'd like to approve."
-                
-                if len(leave_requests) > 1:
-                    # If multiple requests match, list them for selection
-                    request_list = "\n".join([
-                        f"ID: {lr.id} - {db.query(User).get(lr.user_id).username}: {lr.leave_type} leave from {lr.start_date} to {lr.end_date}"
-                        for lr in leave_requests[:5]  # Limit to 5 results
-                    ])
-                    return f"I found multiple pending leave requests. Please specify which one you'd like to {approval_details.get('decision', 'process')}:\n\n{request_list}"
-                
-                # Process the single matching request
-                leave_request = leave_requests[0]
-                employee = db.query(User).get(leave_request.user_id)
-                
-                decision = approval_details.get("decision", "").lower()
-                if decision == "approve":
-                    leave_request.status = "approved"
-                    leave_request.approved_by = user_info.get("id")
-                    leave_request.approved_at = datetime.now()
-                    leave_request.comment = approval_details.get("comment", "Approved")
-                    
-                    # Update calendar and other systems
-                    calendar_update = {
-                        "action": "create_event",
-                        "user_email": employee.email,
-                        "title": f"{leave_request.leave_type.capitalize()} Leave",
-                        "start_date": leave_request.start_date.isoformat(),
-                        "end_date": leave_request.end_date.isoformat(),
-                        "description": leave_request.reason
-                    }
-                    await update_gsuite_resources(calendar_update)
-                    
-                    db.commit()
-                    return f"Leave request #{leave_request.id} for {employee.username} has been approved successfully. They have been notified of this decision."
-                    
-                elif decision == "reject":
-                    leave_request.status = "rejected"
-                    leave_request.approved_by = user_info.get("id")
-                    leave_request.approved_at = datetime.now()
-                    leave_request.comment = approval_details.get("comment", "Rejected")
-                    
-                    db.commit()
-                    return f"Leave request #{leave_request.id} for {employee.username} has been rejected. They have been notified of this decision."
-                    
-                else:
-                    return "Please specify whether you want to 'approve' or 'reject' this leave request."
-                
-            finally:
-                db.close()
+            # When the request ID and decision are spelled out, skip the extraction call
+            approval_details = _explicit_decision(message)
+            if approval_details is None:
+                extraction_result = await get_gemini_response(approval_prompt, user_id, "system", response_schema=APPROVAL_SCHEMA)
+                approval_details = _parse_extraction(extraction_result, ApprovalExtraction)
+            
+            response, calendar_update = await run_in_session(self._apply_leave_decision, approval_details, user_info.get("id"))
+            
+            # Update calendar and other systems in the background once the decision is committed
+            if calendar_update:
+                _run_in_background(_sync_calendar(calendar_update))
+            
+            return response
                 
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValidationError):
             logger.error(f"Failed to parse approval details JSON: {extraction_result}")
             return "I'm having trouble understanding your approval request. Please try again with a clearer format like 'Approve John's leave request' or 'Reject leave request #123'."
             
@@ -248,72 +436,192 @@ class LeaveManagerAgent:
             logger.error(f"Error processing leave approval: {str(e)}")
             return "I encountered an error while processing the leave approval. Please try again or check the request details."
     
+    def _apply_leave_decision(self, db, approval_details: Dict, approver_id) -> Tuple[str, Optional[Dict]]:
+        """Approve or reject the matching pending request; returns the reply and any calendar update to make"""
+        # Try to find the leave request
+        # Load the listed requests' employees in one batched IN query rather than one lazy load each
+        query = (
+            db.query(LeaveRequest)
+            .options(selectinload(LeaveRequest.employee))
+            .filter(LeaveRequest.status == "pending")
+        )
+        
+        if approval_details.get("request_id"):
+            query = query.filter(LeaveRequest.id == approval_details["request_id"])
+            
+        if approval_details.get("employee_name"):
+            employee = _resolve_employee(db, approval_details["employee_name"])
+            if employee:
+                query = query.filter(LeaveRequest.employee_id == employee[0])
+            else:
+                return f"I couldn't find an employee named '{approval_details['employee_name']}' in our system.", None
+        
+        # If there's still ambiguity; at most 5 are ever listed, so fetch no more
+        leave_requests = query.order_by(LeaveRequest.start_date).limit(5).all()
+        
+        if not leave_requests:
+            return "I couldn't find any pending leave requests matching your criteria. Please specify which request you'd like to approve.", None
+        
+        if len(leave_requests) > 1:
+            # If multiple requests match, list them for selection
+            request_list = "\n".join([
+                f"ID: {lr.id} - {lr.employee.username}: {lr.leave_type} leave from {lr.start_date} to {lr.end_date}"
+                for lr in leave_requests
+            ])
+            return f"I found multiple pending leave requests. Please specify which one you'd like to {approval_details.get('decision', 'process')}:\n\n{request_list}", None
+        
+        # Process the single matching request
+        leave_request = leave_requests[0]
+        employee = leave_request.employee
+        
+        decision = approval_details.get("decision", "").lower()
+        if decision == "approve":
+            leave_request.status = "approved"
+            leave_request.approved_by = approver_id
+            leave_request.approved_at = datetime.now()
+            leave_request.comment = approval_details.get("comment", "Approved")
+            adjust_leave_balance(db, leave_request.employee_id, leave_request)
+            
+            # Calendar and other systems are updated by the caller after the commit
+            calendar_update = _approval_task_result(
+                leave_request.id, employee.id, employee.username, leave_request.leave_type,
+                leave_request.start_date, leave_request.end_date
+            )
+            
+            db.commit()
+            return f"Leave request #{leave_request.id} for {employee.username} has been approved successfully. They have been notified of this decision.", calendar_update
+            
+        elif decision == "reject":
+            leave_request.status = "rejected"
+            leave_request.approved_by = approver_id
+            leave_request.approved_at = datetime.now()
+            leave_request.comment = approval_details.get("comment", "Rejected")
+            
+            db.commit()
+            return f"Leave request #{leave_request.id} for {employee.username} has been rejected. They have been notified of this decision.", None
+            
+        else:
+            return "Please specify whether you want to 'approve' or 'reject' this leave request.", None
+    
+    @staticmethod
+    def _batch_approval_reply(request_ids: List[int], approved_ids: List[int]) -> str:
+        """Summarize which requests of a batch approval went through"""
+        if not approved_ids:
+            return "None of those leave requests are pending, so nothing was approved."
+        
+        approved = set(approved_ids)
+        lines = [f"Approved leave requests {', '.join(f'#{request_id}' for request_id in request_ids if request_id in approved)}."]
+        skipped = [f"#{request_id}" for request_id in request_ids if request_id not in approved]
+        if skipped:
+            lines.append(f"Not approved (not found or no longer pending): {', '.join(skipped)}.")
+        return "\n".join(lines)
+    
+    async def approve_many(self, request_ids: List[int], approver_id: int) -> List[int]:
+        """Approve a batch of pending leave requests at once; returns the ids that were approved"""
+        approved_ids, calendar_updates = await run_in_session(self._approve_many, request_ids, approver_id)
+        
+        for calendar_update in calendar_updates:
+            _run_in_background(_sync_calendar(calendar_update))
+        
+        return approved_ids
+    
+    def _approve_many(self, db, request_ids: List[int], approver_id: int) -> Tuple[List[int], List[Dict]]:
+        """Approve every still-pending request in request_ids with a single UPDATE"""
+        approved = db.execute(
+            update(LeaveRequest)
+            .where(LeaveRequest.id.in_(request_ids), LeaveRequest.status == "pending")
+            .values(status="approved", approved_by=approver_id, approved_at=func.now())
+            .returning(
+                LeaveRequest.id, LeaveRequest.employee_id, LeaveRequest.leave_type,
+                LeaveRequest.start_date, LeaveRequest.end_date, LeaveRequest.reason
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not approved:
+            return [], []
+        
+        adjust_leave_balances(db, approved)
+        
+        # One lookup for every affected employee's name, for the calendar events
+        names = dict(db.query(User.id, User.username).filter(User.id.in_({leave.employee_id for leave in approved})).all())
+        calendar_updates = [
+            _approval_task_result(
+                leave.id, leave.employee_id, names.get(leave.employee_id, "Employee"), leave.leave_type,
+                leave.start_date, leave.end_date
+            )
+            for leave in approved
+        ]
+        
+        logger.info(f"Approved {len(approved)} of {len(request_ids)} leave requests in one batch")
+        return [leave.id for leave in approved], calendar_updates
+    
     async def _handle_leave_balance(self, message: str, user_id: str, user_info: Dict) -> str:
         """Handle inquiries about leave balance"""
         
-        db = SessionLocal()
         try:
-            user = db.query(User).filter(User.id == user_info.get("id")).first()
-            if not user:
-                return "I couldn't find your user profile in our system. Please contact HR for assistance."
-            
-            # In a real system, this would fetch from the leave balance table
-            # This is a simplified example
-            annual_balance = 20  # Example values
-            sick_balance = 10
-            personal_balance = 5
-            
-            # Calculate used leaves this year
-            year_start = datetime(datetime.now().year, 1, 1).date()
-            year_end = datetime(datetime.now().year, 12, 31).date()
-            
-            approved_leaves = db.query(LeaveRequest).filter(
-                LeaveRequest.user_id == user.id,
+            return await run_in_session(self._leave_balance_summary, user_info.get("id"))
+            
+        except Exception as e:
+            logger.error(f"Error retrieving leave balance: {str(e)}")
+            return "I encountered an error while retrieving your leave balance. Please try again or contact HR for assistance."
+    
+    def _leave_balance_summary(self, db, user_db_id) -> str:
+        """Build the leave balance summary for a user"""
+        user = db.get(User, user_db_id)
+        if not user:
+            return "I couldn't find your user profile in our system. Please contact HR for assistance."
+        
+        # In a real system, this would fetch from the leave balance table
+        # This is a simplified example
+        annual_balance = 20  # Example values
+        sick_balance = 10
+        personal_balance = 5
+        
+        # Calculate used leaves this year
+        today = date.today()
+        year_start, year_end = date(today.year, 1, 1), date(today.year, 12, 31)
+        
+        # Days used per type, summed by the database in a single GROUP BY
+        used_by_type = dict(
+            db.query(LeaveRequest.leave_type, func.sum(LEAVE_DAYS))
+            .filter(
+                LeaveRequest.employee_id == user.id,
                 LeaveRequest.status == "approved",
                 LeaveRequest.start_date >= year_start,
                 LeaveRequest.end_date <= year_end
-            ).all()
-            
-            # Calculate days used per type
-            annual_used = sum(
-                (leave.end_date - leave.start_date).days + 1 
-                for leave in approved_leaves if leave.leave_type == "annual"
-            )
-            
-            sick_used = sum(
-                (leave.end_date - leave.start_date).days + 1 
-                for leave in approved_leaves if leave.leave_type == "sick"
-            )
-            
-            personal_used = sum(
-                (leave.end_date - leave.start_date).days + 1 
-                for leave in approved_leaves if leave.leave_type == "personal"
             )
-            
-            # Pending leaves
-            pending_leaves = db.query(LeaveRequest).filter(
-                LeaveRequest.user_id == user.id,
-                LeaveRequest.status == "pending"
-            ).all()
-            
-            pending_info = ""
-            if pending_leaves:
-                pending_list = "\n".join([
-                    f"- {leave.leave_type.capitalize()} leave from {leave.start_date} to {leave.end_date} ({(leave.end_date - leave.start_date).days + 1} days)"
-                    for leave in pending_leaves[:3]  # Limit to 3 results
-                ])
-                pending_info = f"\n\nYou also have {len(pending_leaves)} pending leave request(s):\n{pending_list}"
-                if len(pending_leaves) > 3:
-                    pending_info += f"\n...and {len(pending_leaves) - 3} more pending request(s)."
-            
-            return f"Here's your current leave balance for {datetime.now().year}:\n\n" \
-                   f"Annual Leave: {annual_balance - annual_used} days remaining (used {annual_used} of {annual_balance})\n" \
-                   f"Sick Leave: {sick_balance - sick_used} days remaining (used {sick_used} of {sick_balance})\n" \
-                   f"Personal Leave: {personal_balance - personal_used} days remaining (used {personal_used} of {personal_balance})" \
-                   f"{pending_info}"
-                
-        finally:
-            db.close()
+            .group_by(LeaveRequest.leave_type)
+            .all()
+        )
+        
+        annual_used = int(used_by_type.get("annual") or 0)
+        sick_used = int(used_by_type.get("sick") or 0)
+        personal_used = int(used_by_type.get("personal") or 0)
+        
+        # Pending leaves: the total as a scalar count, and only the first 3 rows for display
+        pending_query = db.query(LeaveRequest).filter(
+            LeaveRequest.employee_id == user.id,
+            LeaveRequest.status == "pending"
+        )
+        pending_total = pending_query.with_entities(func.count(LeaveRequest.id)).scalar()
+        
+        pending_info = ""
+        if pending_total:
+            pending_leaves = pending_query.order_by(LeaveRequest.start_date).limit(3).all()
+            pending_list = "\n".join([
+                f"- {leave.leave_type.capitalize()} leave from {leave.start_date} to {leave.end_date} ({(leave.end_date - leave.start_date).days + 1} days)"
+                for leave in pending_leaves
+            ])
+            pending_info = f"\n\nYou also have {pending_total} pending leave request(s):\n{pending_list}"
+            if pending_total > 3:
+                pending_info += f"\n...and {pending_total - 3} more pending request(s)."
+        
+        return BALANCE_TEMPLATE.format(
+            year=today.year,
+            annual_left=annual_balance - annual_used, annual_used=annual_used, annual_balance=annual_balance,
+            sick_left=sick_balance - sick_used, sick_used=sick_used, sick_balance=sick_balance,
+            personal_left=personal_balance - personal_used, personal_used=personal_used, personal_balance=personal_balance
+        ) + pending_info
     
     async def _handle_leave_cancellation(self, message: str, user_id: str, user_info: Dict) -> str:
         """Handle cancellation of leave requests"""
@@ -332,90 +640,39 @@ class LeaveManagerAgent:
         Return ONLY the JSON object without explanation.
         """
         
+        # Only used when the date info can't be resolved locally
+        date_prompt = f"""
+        Parse any date information in this message and return start and end dates if possible: {message}
+        
+        Return as JSON with these keys:
+        - start_date: (YYYY-MM-DD format)
+        - end_date: (YYYY-MM-DD format)
+        
+        If you can only determine one date, set both to that date.
+        If you cannot determine dates, set both to null.
+        Return ONLY the JSON object without explanation.
+        """
+        
         try:
-            extraction_result = await get_gemini_response(cancel_prompt, user_id, "system")
-            cancel_details = json.loads(extraction_result)
-            
-            db = SessionLocal()
-            try:
-                # Try to find the leave request
-                query = db.query(LeaveRequest).filter(
-                    LeaveRequest.user_id == user_info.get("id"),
-                    LeaveRequest.status.in_(["pending", "approved"])
+            request_id = _explicit_request_id(message)
+            if request_id is not None:
+                # The request ID is spelled out, so neither extraction nor date parsing is needed
+                cancel_details = {"request_id": request_id}
+            else:
+                extraction_result = await asyncio.wait_for(
+                    get_gemini_response(cancel_prompt, user_id, "system", response_schema=CANCEL_SCHEMA),
+                    LLM_TIMEOUT_SECONDS
                 )
+                cancel_details = _parse_extraction(extraction_result, CancelExtraction)
+            
+            # Resolve the date filter before touching the database
+            date_info = {}
+            if cancel_details.get("date_info"):
+                date_info = await _resolve_date_range(cancel_details["date_info"], date_prompt, user_id)
+            
+            return await run_in_session(self._cancel_leave_request, user_info.get("id"), cancel_details, date_info)
                 
-                if cancel_details.get("request_id"):
-                    query = query.filter(LeaveRequest.id == cancel_details["request_id"])
-                    
-                if cancel_details.get("date_info"):
-                    # Use LLM to parse the date information
-                    date_prompt = f"""
-                    Parse this date information and return start and end dates if possible: {cancel_details["date_info"]}
-                    
-                    Return as JSON with these keys:
-                    - start_date: (YYYY-MM-DD format)
-                    - end_date: (YYYY-MM-DD format)
-                    
-                    If you can only determine one date, set both to that date.
-                    If you cannot determine dates, set both to null.
-                    Return ONLY the JSON object without explanation.
-                    """
-                    
-                    date_result = await get_gemini_response(date_prompt, user_id, "system")
-                    date_info = json.loads(date_result)
-                    
-                    if date_info.get("start_date"):
-                        start_date = datetime.strptime(date_info["start_date"], "%Y-%m-%d").date()
-                        query = query.filter(LeaveRequest.start_date == start_date)
-                        
-                    if date_info.get("end_date"):
-                        end_date = datetime.strptime(date_info["end_date"], "%Y-%m-%d").date()
-                        query = query.filter(LeaveRequest.end_date == end_date)
-                
-                # Get the matching leave requests
-                leave_requests = query.all()
-                
-                if not leave_requests:
-                    return "I couldn't find any active leave requests that match your cancellation criteria. Please specify which leave request you'd like to cancel."
-                
-                if len(leave_requests) > 1:
-                    # If multiple requests match, list them for selection
-                    request_list = "\n".join([
-                        f"ID: {lr.id} - {lr.leave_type.capitalize()} leave from {lr.start_date} to {lr.end_date} (Status: {lr.status.capitalize()})"
-                        for lr in leave_requests[:5]  # Limit to 5 results
-                    ])
-                    return f"I found multiple leave requests that could be cancelled. Please specify which one by ID:\n\n{request_list}"
-                
-                # Process the single matching request
-                leave_request = leave_requests[0]
-                
-                # Cancel the leave
-                previous_status = leave_request.status
-                leave_request.status = "cancelled"
-                leave_request.updated_at = datetime.now()
-                
-                # If it was approved, also update calendar
-                if previous_status == "approved":
-                    calendar_update = {
-                        "action": "delete_event",
-                        "user_email": db.query(User).get(leave_request.user_id).email,
-                        "title": f"{leave_request.leave_type.capitalize()} Leave",
-                        "start_date": leave_request.start_date.isoformat(),
-                        "end_date": leave_request.end_date.isoformat()
-                    }
-                    await update_gsuite_resources(calendar_update)
-                
-                db.commit()
-                
-                # Format the response
-                start_date = leave_request.start_date.strftime("%B %d, %Y")
-                end_date = leave_request.end_date.strftime("%B %d, %Y")
-                return f"Your {leave_request.leave_type} leave request from {start_date} to {end_date} has been successfully cancelled."
-                
-            finally:
-                db.close()
-                
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValidationError):
             logger.error(f"Failed to parse cancel details JSON: {extraction_result}")
             return "I'm having trouble understanding your cancellation request. Please try again with a clearer format like 'Cancel my leave for next week' or 'Cancel leave request #123'."
             
@@ -423,6 +680,58 @@ class LeaveManagerAgent:
             logger.error(f"Error processing leave cancellation: {str(e)}")
             return "I encountered an error while processing the leave cancellation. Please try again or contact HR for assistance."
     
+    def _cancel_leave_request(self, db, user_db_id, cancel_details: Dict, date_info: Dict) -> str:
+        """Cancel the matching active request and return the reply"""
+        # Try to find the leave request
+        query = db.query(LeaveRequest).filter(
+            LeaveRequest.employee_id == user_db_id,
+            LeaveRequest.status.in_(["pending", "approved"])
+        )
+        
+        if cancel_details.get("request_id"):
+            query = query.filter(LeaveRequest.id == cancel_details["request_id"])
+            
+        start_date = _parse_iso_date(date_info.get("start_date"))
+        if start_date:
+            query = query.filter(LeaveRequest.start_date == start_date)
+            
+        end_date = _parse_iso_date(date_info.get("end_date"))
+        if end_date:
+            query = query.filter(LeaveRequest.end_date == end_date)
+        
+        # Get the matching leave requests
+        leave_requests = query.all()
+        
+        if not leave_requests:
+            return "I couldn't find any active leave requests that match your cancellation criteria. Please specify which leave request you'd like to cancel."
+        
+        if len(leave_requests) > 1:
+            # If multiple requests match, list them for selection
+            request_list = "\n".join([
+                f"ID: {lr.id} - {lr.leave_type.capitalize()} leave from {lr.start_date} to {lr.end_date} (Status: {lr.status.capitalize()})"
+                for lr in leave_requests[:5]  # Limit to 5 results
+            ])
+            return f"I found multiple leave requests that could be cancelled. Please specify which one by ID:\n\n{request_list}"
+        
+        # Process the single matching request
+        leave_request = leave_requests[0]
+        
+        # Cancel the leave
+        previous_status = leave_request.status
+        leave_request.status = "cancelled"
+        leave_request.updated_at = datetime.now()
+        
+        # If it was approved, give the days back (gsuite_service has no calendar event removal yet)
+        if previous_status == "approved":
+            adjust_leave_balance(db, leave_request.employee_id, leave_request, direction=-1)
+        
+        db.commit()
+        
+        # Format the response
+        start_date = leave_request.start_date.strftime("%B %d, %Y")
+        end_date = leave_request.end_date.strftime("%B %d, %Y")
+        return f"Your {leave_request.leave_type} leave request from {start_date} to {end_date} has been successfully cancelled."
+    
     async def _handle_leave_listing(self, message: str, user_id: str, user_info: Dict, role: str) -> str:
         """Handle requests to list leave requests"""
         
@@ -441,95 +750,35 @@ class LeaveManagerAgent:
         Return ONLY the JSON object without explanation.
         """
         
+        # Only used when the time frame can't be resolved locally
+        time_prompt = f"""
+        Parse any time frame mentioned in this message and return date ranges: {message}
+        
+        Today is {date.today().isoformat()}.
+        
+        Return as JSON with these keys:
+        - start_date: (YYYY-MM-DD format)
+        - end_date: (YYYY-MM-DD format)
+        
+        If no time frame is mentioned, set both to null.
+        Return ONLY the JSON object without explanation.
+        """
+        
         try:
-            extraction_result = await get_gemini_response(list_prompt, user_id, "system")
-            list_params = json.loads(extraction_result)
+            extraction_result = await asyncio.wait_for(
+                get_gemini_response(list_prompt, user_id, "system", response_schema=LIST_SCHEMA),
+                LLM_TIMEOUT_SECONDS
+            )
+            list_params = _parse_extraction(extraction_result, ListExtraction)
             
-            db = SessionLocal()
-            try:
-                # Determine whose leaves to show
-                target_user_id = user_info.get("id")
-                
-                # If HR/manager is asking about someone else
-                if role in ["hr", "manager"] and list_params.get("employee_name"):
-                    employee = db.query(User).filter(User.username.ilike(f"%{list_params['employee_name']}%")).first()
-                    if employee:
-                        target_user_id = employee.id
-                        employee_name = employee.username
-                    else:
-                        return f"I couldn't find an employee named '{list_params['employee_name']}' in our system."
-                else:
-                    employee_name = user_info.get("name", "you")
-                
-                # Build the query
-                query = db.query(LeaveRequest).filter(LeaveRequest.user_id == target_user_id)
-                
-                # Filter by status if specified
-                if list_params.get("status") and list_params["status"] != "all":
-                    query = query.filter(LeaveRequest.status == list_params["status"])
-                
-                # Filter by time frame if specified
-                if list_params.get("time_frame"):
-                    # Use LLM to parse the time frame
-                    time_prompt = f"""
-                    Parse this time frame and return date ranges: {list_params["time_frame"]}
-                    
-                    Today is {datetime.now().strftime("%Y-%m-%d")}.
-                    
-                    Return as JSON with these keys:
-                    - start_date: (YYYY-MM-DD format)
-                    - end_date: (YYYY-MM-DD format)
-                    
-                    Return ONLY the JSON object without explanation.
-                    """
-                    
-                    time_result = await get_gemini_response(time_prompt, user_id, "system")
-                    time_info = json.loads(time_result)
-                    
-                    if time_info.get("start_date"):
-                        start_date = datetime.strptime(time_info["start_date"], "%Y-%m-%d").date()
-                        query = query.filter(LeaveRequest.start_date >= start_date)
-                        
-                    if time_info.get("end_date"):
-                        end_date = datetime.strptime(time_info["end_date"], "%Y-%m-%d").date()
-                        query = query.filter(LeaveRequest.start_date <= end_date)
-                
-                # Execute the query and limit results
-                leave_requests = query.order_by(LeaveRequest.start_date).limit(10).all()
-                
-                if not leave_requests:
-                    status_text = f" with status '{list_params.get('status')}'" if list_params.get("status") else ""
-                    time_text = f" for {list_params.get('time_frame')}" if list_params.get("time_frame") else ""
-                    return f"No leave requests found for {employee_name}{status_text}{time_text}."
-                
-                # Format the results
-                status_text = f"{list_params.get('status', 'all')} " if list_params.get("status") else ""
-                time_text = f" for {list_params.get('time_frame')}" if list_params.get("time_frame") else ""
-                
-                header = f"Here are the {status_text}leave requests for {employee_name}{time_text}:\n\n"
-                
-                leave_list = []
-                for lr in leave_requests:
-                    status_emoji = {
-                        "pending": "⏳",
-                        "approved": "✅",
-                        "rejected": "❌",
-                        "cancelled": "🚫"
-                    }.get(lr.status, "")
-                    
-                    days = (lr.end_date - lr.start_date).days + 1
-                    day_text = f"{days} day{'s' if days != 1 else ''}"
-                    
-                    leave_list.append(
-                        f"{status_emoji} {lr.leave_type.capitalize()} leave from {lr.start_date} to {lr.end_date} ({day_text}) - {lr.status.capitalize()}"
-                    )
-                
-                return header + "\n".join(leave_list)
-                
-            finally:
-                db.close()
+            # Resolve the time frame before touching the database
+            time_info = {}
+            if list_params.get("time_frame"):
+                time_info = await _resolve_date_range(list_params["time_frame"], time_prompt, user_id)
+            
+            return await run_in_session(self._list_leave_requests, user_info, role, list_params, time_info)
                 
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValidationError):
             logger.error(f"Failed to parse list parameters JSON: {extraction_result}")
             return "I'm having trouble understanding your request. Please try again with a clearer format like 'Show my pending leaves' or 'List John's approved leaves for next month'."
             
@@ -537,157 +786,167 @@ class LeaveManagerAgent:
             logger.error(f"Error processing leave listing: {str(e)}")
             return "I encountered an error while retrieving leave information. Please try again or be more specific in your request."
     
+    def _list_leave_requests(self, db, user_info: Dict, role: str, list_params: Dict, time_info: Dict) -> str:
+        """Build the list of leave requests matching the extracted filters"""
+        # Determine whose leaves to show
+        target_user_id = user_info.get("id")
+        
+        # If HR/manager is asking about someone else
+        if role in ["hr", "manager"] and list_params.get("employee_name"):
+            employee = _resolve_employee(db, list_params["employee_name"])
+            if employee:
+                target_user_id, employee_name = employee
+            else:
+                return f"I couldn't find an employee named '{list_params['employee_name']}' in our system."
+        else:
+            employee_name = user_info.get("name", "you")
+        
+        # Build the query
+        query = db.query(LeaveRequest).filter(LeaveRequest.employee_id == target_user_id)
+        
+        # Filter by status if specified
+        if list_params.get("status") and list_params["status"] != "all":
+            query = query.filter(LeaveRequest.status == list_params["status"])
+        
+        # Filter by time frame if specified
+        start_date = _parse_iso_date(time_info.get("start_date"))
+        if start_date:
+            query = query.filter(LeaveRequest.start_date >= start_date)
+            
+        end_date = _parse_iso_date(time_info.get("end_date"))
+        if end_date:
+            query = query.filter(LeaveRequest.start_date <= end_date)
+        
+        # Execute the query and limit results
+        leave_requests = query.order_by(LeaveRequest.start_date).limit(10).all()
+        
+        if not leave_requests:
+            status_text = f" with status '{list_params.get('status')}'" if list_params.get("status") else ""
+            time_text = f" for {list_params.get('time_frame')}" if list_params.get("time_frame") else ""
+            return f"No leave requests found for {employee_name}{status_text}{time_text}."
+        
+        # Format the results
+        status_text = f"{list_params.get('status', 'all')} " if list_params.get("status") else ""
+        time_text = f" for {list_params.get('time_frame')}" if list_params.get("time_frame") else ""
+        
+        header = f"Here are the {status_text}leave requests for {employee_name}{time_text}:\n\n"
+        
+        leave_list = "\n".join(
+            f"{STATUS_EMOJI.get(lr.status, '')} {lr.leave_type.capitalize()} leave from {lr.start_date} to {lr.end_date} "
+            f"({_day_text((lr.end_date - lr.start_date).days + 1)}) - {lr.status.capitalize()}"
+            for lr in leave_requests
+        )
+        
+        return f"{header}{leave_list}"
+    
     async def _handle_general_leave_query(self, message: str, user_id: str, user_info: Dict) -> str:
         """Handle general questions about leave policies or other leave-related queries"""
         
+        role = user_info.get('role', 'employee')
+        cache_key = (role, normalize_message(message))
+        cached = _policy_answer_cache.get(cache_key)
+        if cached:
+            logger.info(f"Leave policy answer cache hit, skipped a {len(LEAVE_POLICY) + len(message)} character prompt")
+            return cached
+        
         # Use LLM to generate a response based on company leave policies
-        policy_prompt = f"""
-        Answer this leave policy related question:
+        policy_prompt = f"""{LEAVE_POLICY}
+        Using only the policies above, answer this leave policy related question concisely and professionally.
         
-        USER ROLE: {user_info.get('role', 'employee')}
+        USER ROLE: {role}
         QUESTION: {message}
-        
-        Use these company leave policies:
-        - Annual leave: 20 days per year, accruing monthly
-        - Sick leave: 10 days per year, requires doctor's note for 3+ consecutive days
-        - Personal leave: 5 days per year for personal matters
-        - Bereavement leave: Up to 5 days for immediate family
-        - Parental leave: 12 weeks for primary caregiver, 4 weeks for secondary
-        - Unpaid leave: Considered on case-by-case basis after paid leave is exhausted
-        - Leave requests should be submitted at least 2 weeks in advance except for emergencies
-        - All leave requests require manager approval
-        - Carryover policy: Up to 5 days of annual leave can be carried over to next year
-        
-        Answer concisely and professionally.
         """
         
         try:
             response = await get_gemini_response(policy_prompt, user_id, "hr_assistant")
+            if response and response != GEMINI_ERROR_RESPONSE:
+                _policy_answer_cache.set(cache_key, response)
             return response
             
         except Exception as e:
             logger.error(f"Error processing general leave query: {str(e)}")
             return "I'm sorry, I'm having trouble answering your question about our leave policies. Please contact HR for more information or try asking in a different way."
         
-    async def _notify_manager(self, manager_id: str, leave_request: LeaveRequest) -> None:
+    async def _notify_manager(self, notification: Dict) -> None:
         """Send notification to manager about a new leave request"""
         try:
-            db = SessionLocal()
-            try:
-                # Get manager details
-                manager = db.query(User).filter(User.id == manager_id).first()
-                if not manager:
-                    logger.error(f"Manager with ID {manager_id} not found for notification")
-                    return
-                    
-                # Get employee details
-                employee = db.query(User).filter(User.id == leave_request.user_id).first()
-                if not employee:
-                    logger.error(f"Employee with ID {leave_request.user_id} not found for notification")
-                    return
-                    
-                # Calculate duration
-                delta = leave_request.end_date - leave_request.start_date
-                days = delta.days + 1
-                if leave_request.half_day:
-                    days = days - 0.5
-                    
-                # Send notification
-                notification_data = {
-                    "recipient_id": manager.id,
-                    "message": f"New leave request from {employee.username}:\n"
-                            f"Type: {leave_request.leave_type.capitalize()}\n"
-                            f"From: {leave_request.start_date}\n"
-                            f"To: {leave_request.end_date}\n"
-                            f"Duration: {days} day(s)\n"
-                            f"Reason: {leave_request.reason}\n\n"
-                            f"Reply with 'Approve leave for {employee.username}' or 'Reject leave for {employee.username}'"
-                }
-                
-                # Add this to notification queue or send directly
-                # In a real implementation, this would call your notification service
-                logger.info(f"Sending leave approval notification to manager {manager.username}")
-                
-                # Example implementation with a notification service:
-                # await notification_service.send_notification(notification_data)
-                
-            finally:
-                db.close()
+            employee_name = notification["employee_name"]
+            notification_data = {
+                "recipient_id": notification["manager_id"],
+                "message": f"New leave request from {employee_name}:\n"
+                        f"Type: {notification['leave_type'].capitalize()}\n"
+                        f"From: {notification['start_date']}\n"
+                        f"To: {notification['end_date']}\n"
+                        f"Duration: {notification['days']} day(s)\n"
+                        f"Reason: {notification['reason']}\n\n"
+                        f"Reply with 'Approve leave for {employee_name}' or 'Reject leave for {employee_name}'"
+            }
+            
+            # Add this to notification queue or send directly
+            # In a real implementation, this would call your notification service
+            logger.info(f"Sending leave approval notification to manager {notification['manager_name']}")
+            
+            # Example implementation with a notification service:
+            # await notification_service.send_notification(notification_data)
+            
         except Exception as e:
             logger.error(f"Error notifying manager about leave request: {str(e)}")
 
     async def validate_leave_eligibility(self, user_id: str, leave_type: str, start_date: datetime, end_date: datetime) -> Dict:
         """Validate if user is eligible for the requested leave"""
-        db = SessionLocal()
-        try:
-            # Get user information
-            user = db.query(User).filter(User.id == user_id).first()
-            if not user:
-                return {"eligible": False, "reason": "User not found in system"}
-                
-            # Calculate requested days
-            delta = end_date - start_date
-            requested_days = delta.days + 1
-            
-            # Get current balance (simplified example)
-            # In a real system, you'd pull this from a leave balance table
-            balances = {
-                "annual": 20,
-                "sick": 10,
-                "personal": 5,
-                "bereavement": 5,
-                "parental": 84 if user.is_primary_caregiver else 28,
-                "unpaid": 9999  # effectively unlimited
-            }
-            
-            # Calculate used leaves this year
-            year_start = datetime(datetime.now().year, 1, 1).date()
-            year_end = datetime(datetime.now().year, 12, 31).date()
-            
-            used_leaves = db.query(LeaveRequest).filter(
-                LeaveRequest.user_id == user_id,
-                LeaveRequest.status == "approved",
-                LeaveRequest.leave_type == leave_type,
-                LeaveRequest.start_date >= year_start,
-                LeaveRequest.end_date <= year_end
-            ).all()
-            
-            # Sum up used days
-            used_days = sum(
-                (leave.end_date - leave.start_date).days + 1 
-                for leave in used_leaves
-            )
+        return await run_in_session(self._check_leave_eligibility, user_id, leave_type, start_date, end_date)
+    
+    def _check_leave_eligibility(self, db, user_id: str, leave_type: str, start_date: datetime, end_date: datetime) -> Dict:
+        """Check the requested leave against the user's remaining balance and notice rules"""
+        # Get user information
+        user = db.get(User, user_id)
+        if not user:
+            return {"eligible": False, "reason": "User not found in system"}
             
-            # Adjust for half days
-            half_day_count = len([leave for leave in used_leaves if leave.half_day])
-            used_days -= 0.5 * half_day_count
+        # Calculate requested days
+        delta = end_date - start_date
+        requested_days = delta.days + 1
+        
+        # Get current balance (simplified example)
+        # In a real system, you'd pull this from a leave balance table
+        balances = {
+            "annual": 20,
+            "sick": 10,
+            "personal": 5,
+            "bereavement": 5,
+            "parental": 84 if user.is_primary_caregiver else 28,
+            "unpaid": 9999  # effectively unlimited
+        }
+        
+        # Calculate used leaves this year
+        today = date.today()
+        
+        # Read from the balance cache rather than summing the year's approved leaves
+        used_days = get_used_by_type(db, user_id, today.year).get(leave_type, 0)
+        
+        # Calculate remaining balance
+        remaining_balance = balances.get(leave_type, 0) - used_days
+        
+        # Check if eligible
+        if leave_type not in balances:
+            return {"eligible": False, "reason": f"Invalid leave type: {leave_type}"}
             
-            # Calculate remaining balance
-            remaining_balance = balances.get(leave_type, 0) - used_days
+        if remaining_balance < requested_days:
+            return {
+                "eligible": False, 
+                "reason": f"Insufficient {leave_type} leave balance. Requested: {requested_days} days, Available: {remaining_balance} days"
+            }
             
-            # Check if eligible
-            if leave_type not in balances:
-                return {"eligible": False, "reason": f"Invalid leave type: {leave_type}"}
-                
-            if remaining_balance < requested_days:
-                return {
-                    "eligible": False, 
-                    "reason": f"Insufficient {leave_type} leave balance. Requested: {requested_days} days, Available: {remaining_balance} days"
-                }
-                
-            # Additional validation rules
-            # Example: Check if leave is requested with sufficient notice
-            notice_days = (start_date.date() - datetime.now().date()).days
-            if leave_type != "sick" and notice_days < 14:  # 2 weeks notice required
-                return {
-                    "eligible": True,
-                    "warning": f"Leave requested with only {notice_days} days notice. Company policy recommends 14 days notice."
-                }
-                
-            return {"eligible": True}
+        # Additional validation rules
+        # Example: Check if leave is requested with sufficient notice
+        notice_days = (start_date.date() - today).days
+        if leave_type != "sick" and notice_days < 14:  # 2 weeks notice required
+            return {
+                "eligible": True,
+                "warning": f"Leave requested with only {notice_days} days notice. Company policy recommends 14 days notice."
+            }
             
-        finally:
-            db.close()
+        return {"eligible": True}
 
     async def get_team_leave_calendar(self, manager_id: str, start_date: Optional[datetime] = None, 
                                     end_date: Optional[datetime] = None) -> str:
@@ -695,46 +954,60 @@ class LeaveManagerAgent:
         
         if not start_date:
             # Default to current month
-            today = datetime.now()
-            start_date = datetime(today.year, today.month, 1).date()
-            end_date = (datetime(today.year, today.month + 1, 1) - timedelta(days=1)).date()
+            today = date.today()
+            start_date = today.replace(day=1)
+            end_date = today.replace(day=calendar.monthrange(today.year, today.month)[1])
         
-        db = SessionLocal()
-        try:
-            # Get all team members
-            team_members = db.query(User).filter(User.manager_id == manager_id).all()
-            if not team_members:
-                return "You don't have any team members reporting to you."
-                
-            # Get approved leaves in the date range
-            team_leaves = {}
-            for member in team_members:
-                leaves = db.query(LeaveRequest).filter(
-                    LeaveRequest.user_id == member.id,
-                    LeaveRequest.status == "approved",
-                    LeaveRequest.start_date <= end_date,
-                    LeaveRequest.end_date >= start_date
-                ).all()
-                
-                if leaves:
-                    team_leaves[member.username] = leaves
+        entries = await self.get_team_leave_entries(manager_id, start_date, end_date)
+        if entries is None:
+            return "You don't have any team members reporting to you."
+        if not entries:
+            return f"No approved leaves for your team between {start_date} and {end_date}."
             
-            if not team_leaves:
-                return f"No approved leaves for your team between {start_date} and {end_date}."
-                
-            # Generate calendar view
-            result = f"Team Leave Calendar ({start_date} to {end_date}):\n\n"
-            
-            for username, leaves in team_leaves.items():
-                result += f"{username}:\n"
-                for leave in leaves:
-                    result += f"• {leave.leave_type.capitalize()} leave: {leave.start_date} to {leave.end_date}\n"
-                result += "\n"
-                
-            return result
+        # Generate calendar view
+        lines = [f"Team Leave Calendar ({start_date} to {end_date}):\n\n"]
+        
+        for username, group in groupby(entries, key=lambda entry: entry["username"]):
+            lines.append(f"{username}:\n")
+            for entry in group:
+                lines.append(f"• {entry['leave_type'].capitalize()} leave: {entry['start_date']} to {entry['end_date']}\n")
+            lines.append("\n")
             
-        finally:
-            db.close()
+        return "".join(lines)
+    
+    async def get_team_leave_entries(self, manager_id: str, start_date, end_date) -> Optional[List[Dict]]:
+        """
+        Approved leaves of a manager's team overlapping the date range, ordered by username then start date
+        
+        Returns None if the manager has no reports. Results are cached briefly, since managers
+        and HR tend to flip between the same views.
+        """
+        cache_key = (manager_id, start_date, end_date)
+        entries = _team_calendar_cache.get(cache_key, _NOT_CACHED)
+        if entries is _NOT_CACHED:
+            entries = await run_in_session(self._team_leave_entries, manager_id, start_date, end_date)
+            _team_calendar_cache.set(cache_key, entries)
+        return entries
+    
+    def _team_leave_entries(self, db, manager_id: str, start_date, end_date) -> Optional[List[Dict]]:
+        """Load the team's approved leaves in the date range as plain dicts"""
+        # Check the manager has a team at all
+        if not db.query(User.id).filter(User.manager_id == manager_id).first():
+            return None
+            
+        # Get the whole team's approved leaves in the date range in one query
+        rows = db.query(
+            User.username, LeaveRequest.leave_type, LeaveRequest.start_date, LeaveRequest.end_date
+        ).select_from(LeaveRequest).join(
+            User, User.id == LeaveRequest.employee_id
+        ).filter(
+            User.manager_id == manager_id,
+            LeaveRequest.status == "approved",
+            LeaveRequest.start_date <= end_date,
+            LeaveRequest.end_date >= start_date
+        ).order_by(User.username, LeaveRequest.start_date).all()
+        
+        return [row._asdict() for row in rows]
 
     async def handle_leave_report(self, message: str, user_id: str, user_info: Dict, role: str) -> str:
         """Generate reports about leave patterns, usage, etc. for HR and managers"""
@@ -758,8 +1031,12 @@ class LeaveManagerAgent:
         """
         
         try:
-            extraction_result = await get_gemini_response(report_prompt, user_id, "system")
-            report_params = json.loads(extraction_result)
+            cache_key = normalize_message(message)
+            report_params = _report_params_cache.get(cache_key)
+            if report_params is None:
+                extraction_result = await get_gemini_response(report_prompt, user_id, "system", response_schema=REPORT_SCHEMA)
+                report_params = _parse_extraction(extraction_result, ReportExtraction)
+                _report_params_cache.set(cache_key, report_params)
             
             report_type = report_params.get("report_type", "usage")
             
@@ -778,41 +1055,7 @@ class LeaveManagerAgent:
                         
             elif report_type == "upcoming":
                 # Show upcoming leaves across the organization (for HR) or team (for managers)
-                db = SessionLocal()
-                try:
-                    today = datetime.now().date()
-                    next_month = today + timedelta(days=30)
-                    
-                    query = db.query(LeaveRequest).filter(
-                        LeaveRequest.status == "approved",
-                        LeaveRequest.start_date >= today,
-                        LeaveRequest.start_date <= next_month
-                    )
-                    
-                    if role == "manager":
-                        # Get team member IDs
-                        team_ids = [user.id for user in db.query(User).filter(User.manager_id == user_info.get("id")).all()]
-                        if team_ids:
-                            query = query.filter(LeaveRequest.user_id.in_(team_ids))
-                        else:
-                            return "You don't have any team members reporting to you."
-                    
-                    upcoming_leaves = query.order_by(LeaveRequest.start_date).all()
-                    
-                    if not upcoming_leaves:
-                        return "No upcoming approved leaves for the next 30 days."
-                    
-                    # Format the results
-                    result = "Upcoming leaves for the next 30 days:\n\n"
-                    for leave in upcoming_leaves:
-                        user = db.query(User).get(leave.user_id)
-                        days = (leave.end_date - leave.start_date).days + 1
-                        result += f"• {user.username}: {leave.leave_type.capitalize()} leave from {leave.start_date} to {leave.end_date} ({days} days)\n"
-                    
-                    return result
-                    
-                finally:
-                    db.close()
+                return await run_in_session(self._upcoming_leaves_report, role, user_info.get("id"))
                     
             elif report_type == "department":
                 # Show department-wide leave statistics (for HR only)
@@ -828,90 +1071,106 @@ class LeaveManagerAgent:
                 
             else:  # Default to usage report
                 # Generate leave usage statistics
-                db = SessionLocal()
-                try:
-                    year_start = datetime(datetime.now().year, 1, 1).date()
-                    year_end = datetime(datetime.now().year, 12, 31).date()
-                    
-                    # For managers, show their team's usage
-                    if role == "manager":
-                        team_members = db.query(User).filter(User.manager_id == user_info.get("id")).all()
-                        if not team_members:
-                            return "You don't have any team members reporting to you."
-                            
-                        result = "Leave usage report for your team:\n\n"
-                        
-                        for member in team_members:
-                            approved_leaves = db.query(LeaveRequest).filter(
-                                LeaveRequest.user_id == member.id,
-                                LeaveRequest.status == "approved",
-                                LeaveRequest.start_date >= year_start,
-                                LeaveRequest.end_date <= year_end
-                            ).all()
-                            
-                            # Calculate days used per type
-                            leave_stats = {}
-                            for leave in approved_leaves:
-                                days = (leave.end_date - leave.start_date).days + 1
-                                if leave.half_day:
-                                    days -= 0.5
-                                    
-                                leave_type = leave.leave_type
-                                if leave_type not in leave_stats:
-                                    leave_stats[leave_type] = 0
-                                leave_stats[leave_type] += days
-                                
-                            # Add to result
-                            result += f"{member.username}:\n"
-                            for leave_type, days in leave_stats.items():
-                                result += f"- {leave_type.capitalize()}: {days} days\n"
-                            result += "\n"
-                        
-                        return result
-                        
-                    # For HR, show organization-wide statistics
-                    else:
-                        # This would be a more complex report in a real implementation
-                        # Simplified example
-                        approved_leaves = db.query(LeaveRequest).filter(
-                            LeaveRequest.status == "approved",
-                            LeaveRequest.start_date >= year_start,
-                            LeaveRequest.end_date <= year_end
-                        ).all()
-                        
-                        # Calculate stats by leave type
-                        leave_stats = {}
-                        for leave in approved_leaves:
-                            days = (leave.end_date - leave.start_date).days + 1
-                            if leave.half_day:
-                                days -= 0.5
-                                
-                            leave_type = leave.leave_type
-                            if leave_type not in leave_stats:
-                                leave_stats[leave_type] = 0
-                            leave_stats[leave_type] += days
-                        
-                        result = "Organization-wide leave usage this year:\n\n"
-                        for leave_type, days in leave_stats.items():
-                            result += f"{leave_type.capitalize()}: {days} days\n"
-                        
-                        # Add some additional statistics
-                        total_employees = db.query(User).count()
-                        total_leaves = len(approved_leaves)
-                        
-                        result += f"\nTotal employees: {total_employees}\n"
-                        result += f"Total leave requests: {total_leaves}\n"
-                        result += f"Average leaves per employee: {total_leaves / total_employees:.1f}\n"
-                        
-                        return result
-                
-                finally:
-                    db.close()
+                return await run_in_session(self._leave_usage_report, role, user_info.get("id"))
         
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValidationError):
             logger.error(f"Failed to parse report parameters JSON: {extraction_result}")
             return "I'm having trouble understanding your report request. Please try again with a clearer format like 'Show leave usage report for my team' or 'Generate department leave calendar for Engineering'."
             
         except Exception as e:
             logger.error(f"Error generating leave report: {str(e)}")
-            return "I encountered an error while generating the leave report. Please try again or contact the system administrator."
\ No newline at end of file
+            return "I encountered an error while generating the leave report. Please try again or contact the system administrator."
+    
+    def _upcoming_leaves_report(self, db, role: str, manager_id) -> str:
+        """Build the report of approved leaves starting in the next 30 days"""
+        today = date.today()
+        next_month = today + timedelta(days=30)
+        
+        # Join the employee's name in so formatting doesn't look each user up separately
+        query = db.query(LeaveRequest, User.username).join(
+            User, User.id == LeaveRequest.employee_id
+        ).filter(
+            LeaveRequest.status == "approved",
+            LeaveRequest.start_date >= today,
+            LeaveRequest.start_date <= next_month
+        )
+        
+        if role == "manager":
+            if not db.query(User.id).filter(User.manager_id == manager_id).first():
+                return "You don't have any team members reporting to you."
+            query = query.filter(User.manager_id == manager_id)
+        
+        upcoming_leaves = query.order_by(LeaveRequest.start_date).all()
+        
+        if not upcoming_leaves:
+            return "No upcoming approved leaves for the next 30 days."
+        
+        # Format the results
+        lines = ["Upcoming leaves for the next 30 days:\n\n"]
+        for leave, username in upcoming_leaves:
+            days = (leave.end_date - leave.start_date).days + 1
+            lines.append(f"• {username}: {leave.leave_type.capitalize()} leave from {leave.start_date} to {leave.end_date} ({days} days)\n")
+        
+        return "".join(lines)
+    
+    def _leave_usage_report(self, db, role: str, manager_id) -> str:
+        """Build the leave usage report for a manager's team or the whole organization"""
+        today = date.today()
+        year_start, year_end = date(today.year, 1, 1), date(today.year, 12, 31)
+        
+        # For managers, show their team's usage
+        if role == "manager":
+            # Days used per member and type in one query; the outer join keeps members with no leave
+            rows = db.query(User.username, LeaveRequest.leave_type, func.sum(LEAVE_DAYS)).outerjoin(
+                LeaveRequest,
+                and_(
+                    LeaveRequest.employee_id == User.id,
+                    LeaveRequest.status == "approved",
+                    LeaveRequest.start_date >= year_start,
+                    LeaveRequest.end_date <= year_end
+                )
+            ).filter(
+                User.manager_id == manager_id
+            ).group_by(User.username, LeaveRequest.leave_type).order_by(User.username).all()
+            if not rows:
+                return "You don't have any team members reporting to you."
+                
+            lines = ["Leave usage report for your team:\n\n"]
+            
+            for username, group in groupby(rows, key=lambda row: row[0]):
+                lines.append(f"{username}:\n")
+                for _, leave_type, days in group:
+                    if leave_type:
+                        lines.append(f"- {leave_type.capitalize()}: {float(days):g} days\n")
+                lines.append("\n")
+            
+            return "".join(lines)
+            
+        # For HR, show organization-wide statistics
+        else:
+            # This would be a more complex report in a real implementation
+            # Simplified example
+            # Aggregate days and request counts per leave type in the database
+            leave_stats = db.query(
+                LeaveRequest.leave_type,
+                func.sum(LEAVE_DAYS),
+                func.count(LeaveRequest.id)
+            ).filter(
+                LeaveRequest.status == "approved",
+                LeaveRequest.start_date >= year_start,
+                LeaveRequest.end_date <= year_end
+            ).group_by(LeaveRequest.leave_type).all()
+            
+            lines = ["Organization-wide leave usage this year:\n\n"]
+            for leave_type, days, _ in leave_stats:
+                lines.append(f"{leave_type.capitalize()}: {float(days):g} days\n")
+            
+            # Add some additional statistics
+            total_employees = db.query(User).count()
+            total_leaves = sum(count for _, _, count in leave_stats)
+            
+            lines.append(f"\nTotal employees: {total_employees}\n")
+            lines.append(f"Total leave requests: {total_leaves}\n")
+            lines.append(f"Average leaves per employee: {total_leaves / total_employees:.1f}\n")
+            
+            return "".join(lines)
\ No newline at end of file
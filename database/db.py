@@ -4,6 +4,8 @@ from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
 
+from processors.json_processor import dumps, loads
+
 # Load environment variables
 load_dotenv()
 
@@ -12,7 +14,10 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./hrms.db")
 
 # Create SQLAlchemy engine
 engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+    DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
+    # JSON columns (e.g. TaskRecord.details) go through orjson when it's installed
+    json_serializer=dumps,
+    json_deserializer=loads
 )
 
 # Create SessionLocal class
@@ -1,17 +1,29 @@
+import asyncio
+from contextlib import contextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
 
+from processors.json_processor import dumps, loads
+
 # Load environment variables
 load_dotenv()
 
 # Get database URL from environment or use fallback (PostgreSQL expected)
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# Create SQLAlchemy engine with a pool sized for concurrent webhook traffic
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    pool_pre_ping=True,
+    # JSON columns (e.g. TaskRecord.details) go through orjson when it's installed
+    json_serializer=dumps,
+    json_deserializer=loads
+)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -26,3 +38,29 @@ def get_db():
         yield db
     finally:
         db.close()
+
+@contextmanager
+def session_scope():
+    """Provide a session that commits on success, rolls back on error and is always closed"""
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def run_in_session(fn, *args):
+    """
+    Run fn(db, *args) inside session_scope() on a worker thread
+    
+    Keeps blocking queries off the event loop. fn should return plain values rather than
+    ORM objects, since the session is closed by the time the result is returned.
+    """
+    def _run():
+        with session_scope() as db:
+            return fn(db, *args)
+    
+    return await asyncio.to_thread(_run)
@@ -1,8 +1,10 @@
 import os
 import logging
+import asyncio
 import google.generativeai as genai
 from dotenv import load_dotenv
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Type, get_args
+from pydantic import BaseModel
 
 # Load environment variables
 load_dotenv()
@@ -13,6 +15,8 @@ logger = logging.getLogger(__name__)
 # Configure the Gemini API
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+
 # System prompts for different roles
 SYSTEM_PROMPTS = {
     "employee": """
@@ -49,8 +53,59 @@ SYSTEM_PROMPTS = {
     """
 }
 
+# Upper bound on concurrent Gemini calls, so traffic spikes queue here instead of piling onto the API
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+_gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+# Returned in place of a model response when the Gemini call fails; callers must not cache it
+GEMINI_ERROR_RESPONSE = "I'm sorry, I encountered an error processing your request. Please try again later."
+
+_SCHEMA_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+def response_schema_for(model: Type[BaseModel]) -> Dict:
+    """
+    Build a Gemini response schema from a flat Pydantic model
+    
+    Gemini accepts only a subset of JSON Schema, so optional fields are expressed with
+    "nullable" rather than the anyOf that model_json_schema() would produce.
+    
+    Args:
+        model: Pydantic model whose fields are str, int, float or bool (optionally Optional)
+        
+    Returns:
+        Schema dict suitable for the response_schema generation option
+    """
+    properties = {}
+    for name, field in model.model_fields.items():
+        types = [t for t in get_args(field.annotation) if t is not type(None)] or [field.annotation]
+        properties[name] = {"type": _SCHEMA_TYPES.get(types[0], "string"), "nullable": True}
+    return {"type": "object", "properties": properties}
+
+# One model per role with its system prompt as the native system instruction, built once. The model
+# object is only configuration; per-call options such as a response schema go to send_message instead.
+_ROLE_MODELS = {
+    role: genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=prompt)
+    for role, prompt in SYSTEM_PROMPTS.items()
+}
+
+def _model_for(role: str) -> genai.GenerativeModel:
+    """Model carrying the role's system prompt, falling back to the employee prompt"""
+    return _ROLE_MODELS.get(role) or _ROLE_MODELS.get(role.lower(), _ROLE_MODELS["employee"])
+
+# Earlier turns sent with a call; older ones are dropped so prompts don't grow with conversation length
+MAX_HISTORY_TURNS = int(os.getenv("GEMINI_MAX_HISTORY_TURNS", "20"))
+
+def _chat_history(conversation_history: Optional[List[Dict]] = None) -> List[Dict]:
+    """The most recent MAX_HISTORY_TURNS conversation turns in the chat history format"""
+    recent = (conversation_history or [])[-MAX_HISTORY_TURNS:] if MAX_HISTORY_TURNS else []
+    return [
+        {"role": "user" if entry.get("role") == "user" else "model", "parts": [entry.get("content", "")]}
+        for entry in recent
+    ]
+
 async def get_gemini_response(message: str, user_id: str, role: str = "employee", 
-                             conversation_history: Optional[List[Dict]] = None) -> str:
+                             conversation_history: Optional[List[Dict]] = None,
+                             response_schema: Optional[Dict] = None) -> str:
     """
     Get response from Gemini API based on user role and conversation history
     
@@ -59,39 +114,67 @@ async def get_gemini_response(message: str, user_id: str, role: str = "employee"
         user_id: Unique identifier for user
         role: User role (employee or hr)
         conversation_history: Previous messages for context
+        response_schema: Optional schema (see response_schema_for) to get JSON output conforming to it
         
     Returns:
         Response text from Gemini
     """
+    async with _gemini_semaphore:
+        return await _call_gemini(message, user_id, role, conversation_history, response_schema)
+
+async def _call_gemini(message: str, user_id: str, role: str,
+                       conversation_history: Optional[List[Dict]],
+                       response_schema: Optional[Dict] = None) -> str:
+    """Make a single Gemini call; callers go through get_gemini_response to respect the concurrency limit"""
     try:
-        # Set up the model
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        
-        # Create chat session
-        chat = model.start_chat(history=[])
-        
-        # Add system prompt based on role
-        system_prompt = SYSTEM_PROMPTS.get(role.lower(), SYSTEM_PROMPTS["employee"])
-        chat.send_message(f"[SYSTEM INSTRUCTION] {system_prompt}")
+        # Constrain the output to JSON when a schema is given
+        generation_config = None
+        if response_schema:
+            generation_config = {
+                "response_mime_type": "application/json",
+                "response_schema": response_schema
+            }
         
-        # Add conversation history for context
-        if conversation_history:
-            for entry in conversation_history:
-                role_type = "user" if entry.get("role") == "user" else "model"
-                content = entry.get("content", "")
-                if role_type == "user":
-                    chat.send_message(content)
-                else:
-                    # For model messages, we're just setting up context, 
-                    # not expecting a response
-                    chat._history.append({"role": "model", "parts": [content]})
+        # The role's model carries the system prompt; seed the chat with the conversation history so
+        # only the current message makes a round trip to the API
+        chat = _model_for(role).start_chat(history=_chat_history(conversation_history))
         
-        # Send the current message and get response
-        response = chat.send_message(message)
+        # Send the current message and get response without blocking the event loop
+        response = await chat.send_message_async(message, generation_config=generation_config)
         
         logger.info(f"Gemini API response received for user {user_id}")
         return response.text
         
     except Exception as e:
         logger.error(f"Error in Gemini API call: {str(e)}")
-        return "I'm sorry, I encountered an error processing your request. Please try again later."
\ No newline at end of file
+        return GEMINI_ERROR_RESPONSE
+
+# In-flight Gemini calls keyed by (role, prompt), shared by concurrent identical requests
+_inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+
+async def get_gemini_response_shared(message: str, user_id: str, role: str = "employee") -> str:
+    """
+    Get a Gemini response, coalescing concurrent calls with an identical prompt and role
+    
+    If the same prompt is already being processed, await that call instead of issuing
+    another one. Only suitable for prompts without conversation history.
+    
+    Args:
+        message: Prompt to send
+        user_id: Unique identifier for user (used for logging only)
+        role: User role (employee or hr)
+        
+    Returns:
+        Response text from Gemini
+    """
+    key = (role, message)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(get_gemini_response(message, user_id, role))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        logger.info(f"Joining in-flight Gemini call for user {user_id}")
+    
+    # Shield so one caller being cancelled doesn't cancel the call for everyone else
+    return await asyncio.shield(task)
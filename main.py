@@ -4,6 +4,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from typing import Dict, Optional, List
 import uvicorn
 import logging
+import asyncio
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
 from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
@@ -12,11 +15,12 @@ from datetime import datetime
 
 # Import modules
 from services.orchestrator import orchestrator
-from database.pgDb import get_db, SessionLocal, engine
+from database.pgDb import get_db, SessionLocal, engine, run_in_session
 from models.models import Base, User, ChatSession, ChatMessage
 from services.auth_service import get_current_user
-from services.context_service import retrieve_chat_context
+from services.context_service import load_chat_context
 from services.twilio_service import send_whatsapp_message
+from services.leave_balance_service import seed_leave_balances
 
 # Load environment variables
 load_dotenv()
@@ -35,6 +39,22 @@ logger = logging.getLogger(__name__)
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+def ensure_user_manager_column() -> None:
+    """Add users.manager_id to databases created before it existed; create_all never alters existing tables"""
+    if "manager_id" in {column["name"] for column in inspect(engine).get_columns("users")}:
+        return
+    
+    logger.info("Adding users.manager_id column to existing users table")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE users ADD COLUMN manager_id INTEGER REFERENCES users(id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_manager_id ON users (manager_id)"))
+
+ensure_user_manager_column()
+
+# Eligibility reads the leave balance cache, so fill it from approvals made before it existed
+with SessionLocal() as db:
+    seed_leave_balances(db)
+
 # Initialize FastAPI app
 app = FastAPI(title="LLM HRMS", description="Role-based HR Management System with LLM capabilities")
 
@@ -64,6 +84,19 @@ def json_serial(obj):
         return obj.isoformat()
     raise TypeError("Type not serializable")
 
+def load_sender(db, user_id: str):
+    """Look up the message sender and their chat context in one session"""
+    user = db.query(User).filter(User.phone_number == user_id).first()
+    role = user.role if user else "employee"
+    user_info = {
+        "id": user.id if user else None,
+        "name": user.username if user else "Unknown",
+        "email": user.email if user else "",
+        "phone": user.phone_number if user else user_id,
+        "role": role
+    }
+    return role, user_info, load_chat_context(db, user_id, user)
+
 # Route: Twilio Webhook
 @app.post("/webhook", response_class=PlainTextResponse)
 async def webhook(request: Request):
@@ -74,21 +107,7 @@ async def webhook(request: Request):
 
     logger.info(f"Received message from {sender}: {incoming_msg}")
 
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.phone_number == user_id).first()
-        role = user.role if user else "employee"
-        user_info = {
-            "id": user.id if user else None,
-            "name": user.username if user else "Unknown",
-            "email": user.email if user else "",
-            "phone": user.phone_number if user else user_id,
-            "role": role
-        }
-    finally:
-        db.close()
-
-    context = retrieve_chat_context(user_id)
+    role, user_info, context = await run_in_session(load_sender, user_id)
     response = await orchestrator.process_message(incoming_msg, user_id, user_info, role, context)
 
     # Just return the response — Twilio will send it back to the user
@@ -97,7 +116,7 @@ async def webhook(request: Request):
 
 # Route: Web Chat (Authenticated)
 @app.post("/chat", response_model=MessageResponse)
-async def chat(message_request: MessageRequest, current_user=Depends(get_current_user)):
+async def chat(message_request: MessageRequest, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
     if message_request.role == "hr" and current_user.role != "hr":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -113,7 +132,7 @@ async def chat(message_request: MessageRequest, current_user=Depends(get_current
         "role": current_user.role
     }
 
-    context = retrieve_chat_context(message_request.user_id)
+    context = await asyncio.to_thread(load_chat_context, db, message_request.user_id)
     response = await orchestrator.process_message(
         message_request.message,
         message_request.user_id,
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Enum, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Enum, JSON, Index, Float, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -76,11 +76,13 @@ class User(Base):
     hashed_password = Column(String(255))
     role = Column(String(20), default="employee")
     is_active = Column(Boolean, default=True)
+    manager_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     # Relationships
     chat_sessions = relationship("ChatSession", back_populates="user")
+    manager = relationship("User", remote_side=[id], foreign_keys=[manager_id])
     leaves = relationship(
         "LeaveRequest",
         back_populates="employee",
@@ -95,6 +97,21 @@ class User(Base):
 
 class LeaveRequest(Base):
     __tablename__ = "leave_requests"
+    __table_args__ = (
+        # Balance, listing and cancellation all filter by employee + status + date range
+        Index("ix_leave_employee_status_start", "employee_id", "status", "start_date"),
+        # Eligibility sums one leave type per employee over the year
+        Index("ix_leave_employee_status_type_dates", "employee_id", "status", "leave_type", "start_date", "end_date"),
+        # Org-wide and team reports scan approved leaves by start date
+        Index("ix_leave_status_start", "status", "start_date"),
+        # Approval only ever looks at pending requests
+        Index(
+            "ix_leave_pending",
+            "status",
+            "start_date",
+            postgresql_where=text("status = 'pending'")
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     employee_id = Column(Integer, ForeignKey("users.id"))
@@ -122,6 +139,17 @@ class LeaveRequest(Base):
     )
 
 
+class LeaveBalanceCache(Base):
+    """Approved leave days per user, year and leave type, kept in step with approvals and cancellations"""
+    __tablename__ = "leave_balance_cache"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    leave_type = Column(String(50), primary_key=True)
+    used_days = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 class TaskRecord(Base):
     __tablename__ = "task_records"
     
@@ -0,0 +1,40 @@
+from typing import Optional
+from pydantic import BaseModel
+
+# Structured outputs requested from Gemini by the orchestrator and the leave agent. Every field
+# is optional because the model returns null for anything the message doesn't mention.
+
+class IntentClassification(BaseModel):
+    intent: Optional[str] = None
+    confidence: Optional[float] = None
+    draft_response: Optional[str] = None
+
+class LeaveExtraction(BaseModel):
+    leave_type: Optional[str] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    reason: Optional[str] = None
+
+class ApprovalExtraction(BaseModel):
+    request_id: Optional[int] = None
+    employee_name: Optional[str] = None
+    decision: Optional[str] = None
+    comment: Optional[str] = None
+
+class CancelExtraction(BaseModel):
+    request_id: Optional[int] = None
+    date_info: Optional[str] = None
+
+class ListExtraction(BaseModel):
+    status: Optional[str] = None
+    employee_name: Optional[str] = None
+    time_frame: Optional[str] = None
+
+class ReportExtraction(BaseModel):
+    report_type: Optional[str] = None
+    department: Optional[str] = None
+    time_frame: Optional[str] = None
+
+class DateRangeExtraction(BaseModel):
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
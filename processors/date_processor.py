@@ -0,0 +1,72 @@
+import re
+import calendar
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+# dateparser understands free-form dates ("May 3rd", "15/06"); without it only the fixed phrases below are handled
+try:
+    from dateparser.search import search_dates
+except ImportError:
+    search_dates = None
+
+_DAY_WORDS = {"yesterday": -1, "today": 0, "tomorrow": 1}
+_DAY_RE = re.compile(r"\b(yesterday|today|tomorrow)\b", re.I)
+_PERIOD_RE = re.compile(r"\b(this|current|next|coming|last|previous)\s+(week|month|year)\b", re.I)
+_PERIOD_OFFSETS = {"this": 0, "current": 0, "next": 1, "coming": 1, "last": -1, "previous": -1}
+
+def _shift_month(year: int, month: int, offset: int) -> Tuple[int, int]:
+    """Return (year, month) offset months away"""
+    index = year * 12 + (month - 1) + offset
+    return index // 12, index % 12 + 1
+
+def _period_range(period: str, offset: int, today: date) -> Tuple[date, date]:
+    """First and last day of the week/month/year offset periods away from today"""
+    if period == "week":
+        start = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+        return start, start + timedelta(days=6)
+    if period == "month":
+        year, month = _shift_month(today.year, today.month, offset)
+        return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+    year = today.year + offset
+    return date(year, 1, 1), date(year, 12, 31)
+
+def parse_date_range(text: str, today: Optional[date] = None) -> Optional[Tuple[date, date]]:
+    """
+    Resolve a natural-language date or time frame to a (start, end) date range locally
+
+    Args:
+        text: Date description such as "next week", "tomorrow" or "from 3 May to 7 May"
+        today: Reference date for relative phrases, defaults to the current date
+
+    Returns:
+        (start, end) dates, or None if the text couldn't be resolved without the LLM
+    """
+    if not text:
+        return None
+    today = today or date.today()
+
+    # The shortcuts only apply when the whole text is the phrase; "from tomorrow until next Friday"
+    # is a range and goes to dateparser (or the LLM) instead
+    phrase = text.strip().rstrip(".!?").strip()
+
+    period = _PERIOD_RE.fullmatch(phrase)
+    if period:
+        return _period_range(period.group(2).lower(), _PERIOD_OFFSETS[period.group(1).lower()], today)
+
+    day = _DAY_RE.fullmatch(phrase)
+    if day:
+        resolved = today + timedelta(days=_DAY_WORDS[day.group(1).lower()])
+        return resolved, resolved
+
+    if search_dates is None:
+        return None
+
+    hits = search_dates(text, settings={
+        "RELATIVE_BASE": datetime.combine(today, datetime.min.time()),
+        "PREFER_DATES_FROM": "future"
+    })
+    if not hits:
+        return None
+
+    dates = sorted(found.date() for _, found in hits)
+    return dates[0], dates[-1]
@@ -0,0 +1,36 @@
+import json
+import re
+from typing import Any, Union
+
+# orjson is considerably faster than the stdlib encoder/decoder; fall back to json if it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Outermost {...} block in LLM output, which is often wrapped in ```json fences or prose
+_JSON_BLOCK_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+def dumps(obj: Any) -> str:
+    """Serialize obj to a compact JSON string"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parse a JSON string; raises json.JSONDecodeError on invalid input with either backend"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_block(text: str) -> str:
+    """Cut the JSON object out of an LLM response, or return the text unchanged if it has none"""
+    text = text.strip()
+    if text.startswith("{"):
+        return text
+    match = _JSON_BLOCK_RE.search(text)
+    return match.group(0) if match else text
+
+def extract_json(text: str) -> Any:
+    """Parse the JSON object embedded in an LLM response; raises json.JSONDecodeError if there isn't one"""
+    return loads(json_block(text))
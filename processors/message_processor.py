@@ -4,6 +4,23 @@ from typing import Dict, Optional, List
 
 logger = logging.getLogger(__name__)
 
+# Patterns applied to every message or response, compiled once at import
+_MARKER_RE = re.compile(r'\[SYSTEM.*?\]|\[USER ROLE:.*?\]|\[HR TASK REQUEST\]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+_TASK_EMPLOYEE_RE = re.compile(r'for\s+([A-Za-z0-9\s]+)')
+_TASK_DATES_RE = re.compile(r'from\s+([A-Za-z0-9\s,]+)\s+to\s+([A-Za-z0-9\s,]+)')
+
+HR_TASK_KEYWORDS = (
+    "leave approval", "approve leave",
+    "attendance update", "update attendance",
+    "performance review", "employee record",
+    "update employee", "payroll",
+    "onboarding", "termination"
+)
+# All task keywords in one alternation, so a check is a single pass over the message
+_HR_TASK_RE = re.compile("|".join(map(re.escape, HR_TASK_KEYWORDS)), re.IGNORECASE)
+
 def preprocess_message(message: str, user_id: str,user_info: Dict, role: str = "employee", 
                       context: Optional[Dict] = None) -> str:
     """
@@ -40,10 +57,8 @@ def preprocess_message(message: str, user_id: str,user_info: Dict, role: str = "
     return enhanced_message
 
 def postprocess_response(response: str) -> str:
-    response = re.sub(r'\[SYSTEM.*?\]', '', response)
-    response = re.sub(r'\[USER ROLE:.*?\]', '', response)
-    response = re.sub(r'\[HR TASK REQUEST\]', '', response)
-    response = re.sub(r'\s+', ' ', response).strip()
+    response = _MARKER_RE.sub('', response)
+    response = _WHITESPACE_RE.sub(' ', response).strip()
 
     if len(response) > 300:
         response = insert_line_breaks(response)
@@ -51,21 +66,17 @@ def postprocess_response(response: str) -> str:
     return response
 
 def is_hr_task(message: str) -> bool:
-    hr_task_keywords = [
-        "leave approval", "approve leave", 
-        "attendance update", "update attendance",
-        "performance review", "employee record", 
-        "update employee", "payroll",
-        "onboarding", "termination"
-    ]
-    message_lower = message.lower()
-    return any(keyword in message_lower for keyword in hr_task_keywords)
+    return _HR_TASK_RE.search(message) is not None
 
 def insert_line_breaks(text: str) -> str:
-    sentences = re.split(r'(?<=[.!?])\s+', text)
+    sentences = _SENTENCE_END_RE.split(text)
     paragraphs = [' '.join(sentences[i:i+2]) for i in range(0, len(sentences), 2)]
     return '\n\n'.join(paragraphs)
 
+def normalize_message(message: str) -> str:
+    """Lowercase and collapse whitespace so equivalent messages share a cache key"""
+    return _WHITESPACE_RE.sub(' ', message.strip().lower())
+
 def extract_task_details(message: str) -> Dict:
     task_details = {
         "task_type": None,
@@ -74,14 +85,15 @@ def extract_task_details(message: str) -> Dict:
         "details": None
     }
 
-    if "leave" in message.lower() and ("approve" in message.lower() or "approval" in message.lower()):
+    message_lower = message.lower()
+    if "leave" in message_lower and ("approve" in message_lower or "approval" in message_lower):
         task_details["task_type"] = "leave_approval"
 
-        employee_match = re.search(r'for\s+([A-Za-z0-9\s]+)', message)
+        employee_match = _TASK_EMPLOYEE_RE.search(message)
         if employee_match:
             task_details["employee_id"] = employee_match.group(1).strip()
 
-        date_match = re.search(r'from\s+([A-Za-z0-9\s,]+)\s+to\s+([A-Za-z0-9\s,]+)', message)
+        date_match = _TASK_DATES_RE.search(message)
         if date_match:
             task_details["date_range"] = {
                 "start": date_match.group(1).strip(),
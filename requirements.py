@@ -21,7 +21,7 @@ google-api-python-client==2.115.0
 google-auth==2.27.0
 google-auth-httplib2==0.2.0
 google-auth-oauthlib==1.2.0
-google-generativeai==0.4.0
+google-generativeai==0.7.2  # response_mime_type / response_schema support
 
 # Twilio for WhatsApp
 twilio==8.10.3
@@ -34,9 +34,11 @@ redis==5.0.1
 
 # Utilities
 aiohttp==3.9.3
+orjson==3.9.15  # Faster JSON (optional, falls back to json)
 pandas==2.2.0
 numpy==1.26.3
 pytz==2024.1
 Jinja2==3.1.3
 python-dateutil==2.8.2
+dateparser==1.2.0  # Local natural-language date parsing (optional, falls back to Gemini)
 tenacity==8.2.3  # For retrying API calls
\ No newline at end of file
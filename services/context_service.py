@@ -1,11 +1,15 @@
 import logging
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 import uuid
 from sqlalchemy.orm import Session
 import google.generativeai as genai
 import os
 
-from database.db import SessionLocal
+from database.pgDb import SessionLocal
 from models.models import User, ChatSession, ChatMessage
 
 # Configure logging
@@ -15,19 +19,32 @@ logger = logging.getLogger(__name__)
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 summarization_model = genai.GenerativeModel('gemini-pro')
 
-def get_or_create_chat_session(db: Session, user_id: str) -> ChatSession:
+# Chat history writes run on worker threads off the request path. Each user is pinned to one worker so
+# their messages are stored in order, and each worker's queue is bounded
+CONTEXT_WRITE_WORKERS = int(os.getenv("CONTEXT_WRITE_WORKERS", "4"))
+CONTEXT_WRITE_QUEUE_SIZE = int(os.getenv("CONTEXT_WRITE_QUEUE_SIZE", "1000"))
+_write_queues = [queue.Queue(maxsize=CONTEXT_WRITE_QUEUE_SIZE) for _ in range(CONTEXT_WRITE_WORKERS)]
+
+# Summaries call Gemini, so they get their own thread rather than holding up history writes
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+_pending_summaries = set()
+_pending_summaries_lock = threading.Lock()
+
+def get_or_create_chat_session(db: Session, user_id: str, user: Optional[User] = None) -> ChatSession:
     """
     Get existing chat session or create a new one
     
     Args:
         db: Database session
         user_id: User identifier (phone number or user ID)
+        user: The user if the caller already loaded it in this session
         
     Returns:
         ChatSession object
     """
     # Find user by phone number or create one if not exists
-    user = db.query(User).filter(User.phone_number == user_id).first()
+    if user is None:
+        user = db.query(User).filter(User.phone_number == user_id).first()
     
     if not user:
         # Create placeholder user if not found
@@ -102,7 +119,7 @@ def store_chat_context(user_id: str, user_message: str, assistant_response: str)
         
         # Generate new summary every 5 messages
         if message_count % 5 == 0:
-            update_session_summary(db, session.id)
+            _schedule_summary(session.id)
             
     except Exception as e:
         logger.error(f"Error storing chat context: {str(e)}")
@@ -110,6 +127,55 @@ def store_chat_context(user_id: str, user_message: str, assistant_response: str)
     finally:
         db.close()
 
+async def store_chat_context_in_background(user_id: str, user_message: str, assistant_response: str) -> None:
+    """
+    Queue an exchange for store_chat_context, normally without waiting for the write
+    
+    Only waits, off the event loop, when the user's worker queue is full.
+    
+    Args:
+        user_id: User identifier
+        user_message: Message from user
+        assistant_response: Response from assistant
+    """
+    write_queue = _write_queues[hash(user_id) % len(_write_queues)]
+    item = (user_id, user_message, assistant_response)
+    try:
+        write_queue.put_nowait(item)
+    except queue.Full:
+        logger.warning("Chat context write queue is full; waiting for room")
+        await asyncio.to_thread(write_queue.put, item)
+
+def _write_worker(write_queue: queue.Queue) -> None:
+    """Store queued exchanges one at a time, forever"""
+    while True:
+        user_id, user_message, assistant_response = write_queue.get()
+        store_chat_context(user_id, user_message, assistant_response)
+
+for _worker_number, _write_queue in enumerate(_write_queues):
+    threading.Thread(
+        target=_write_worker, args=(_write_queue,), name=f"chat-context-{_worker_number}", daemon=True
+    ).start()
+
+def _schedule_summary(session_id: int) -> None:
+    """Queue a summary refresh for a session unless one is already waiting"""
+    with _pending_summaries_lock:
+        if session_id in _pending_summaries:
+            return
+        _pending_summaries.add(session_id)
+    _summary_executor.submit(_refresh_summary, session_id)
+
+def _refresh_summary(session_id: int) -> None:
+    """Regenerate a session's summary in its own database session"""
+    with _pending_summaries_lock:
+        _pending_summaries.discard(session_id)
+    
+    db = SessionLocal()
+    try:
+        update_session_summary(db, session_id)
+    finally:
+        db.close()
+
 def update_session_summary(db: Session, session_id: int) -> None:
     """
     Generate and update summary of conversation
@@ -152,7 +218,7 @@ def update_session_summary(db: Session, session_id: int) -> None:
         summary = summary_response.text.strip()
         
         # Update session summary
-        session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+        session = db.get(ChatSession, session_id)
         if session:
             session.summary = summary
             db.commit()
@@ -172,9 +238,26 @@ def retrieve_chat_context(user_id: str) -> Optional[Dict]:
         Dictionary with conversation context
     """
     db = SessionLocal()
+    try:
+        return load_chat_context(db, user_id)
+    finally:
+        db.close()
+
+def load_chat_context(db: Session, user_id: str, user: Optional[User] = None) -> Dict:
+    """
+    Retrieve conversation context for a user using the caller's session
+    
+    Args:
+        db: Database session
+        user_id: User identifier
+        user: The user if the caller already loaded it in this session
+        
+    Returns:
+        Dictionary with conversation context
+    """
     try:
         # Get or create chat session
-        session = get_or_create_chat_session(db, user_id)
+        session = get_or_create_chat_session(db, user_id, user)
         
         # Get recent messages (last 5)
         recent_messages = (
@@ -202,6 +285,5 @@ def retrieve_chat_context(user_id: str) -> Optional[Dict]:
         
     except Exception as e:
         logger.error(f"Error retrieving chat context: {str(e)}")
-        return {"summary": "Error retrieving context", "recent_messages": []}
-    finally:
-        db.close()
\ No newline at end of file
+        db.rollback()
+        return {"summary": "Error retrieving context", "recent_messages": []}
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Callable, Optional
 import logging
 import os
 from google.oauth2 import service_account
@@ -22,8 +22,8 @@ class GoogleSheetsService:
                 creds_path, scopes=scopes
             )
             
-            # Build the service
-            self.service = build('sheets', 'v4', credentials=credentials)
+            # Build the service; the discovery document ships with the client library, so skip the file cache lookup
+            self.service = build('sheets', 'v4', credentials=credentials, cache_discovery=False)
             logger.info("Google Sheets service initialized successfully")
         
         except Exception as e:
@@ -54,6 +54,12 @@ class GoogleSheetsService:
                 sheet_name = f"'{sheet_name}'"
                 
             return f"{sheet_name}!A:Z"
+
+    def cell_range(self, sheet_name: str, row: int, col: int) -> str:
+        """Convert a 1-indexed row/column pair to an A1 range on the given sheet"""
+        col_letter = chr(64 + col) if col <= 26 else chr(64 + col // 26) + chr(64 + col % 26)
+        return f"{sheet_name}!{col_letter}{row}"
+
     async def get_sheet_data(self, spreadsheet_id: str, range_name: str) -> List[List[str]]:
         range_name = self.normalize_range(range_name)
         """Retrieve data from a Google Sheet range"""
@@ -85,6 +91,59 @@ class GoogleSheetsService:
             logger.error(f"Error retrieving sheet data: {e}")
             return []
     
+    async def find_row(self, spreadsheet_id: str, sheet_name: str, column: str,
+                       matches: Callable[[str], bool]) -> Optional[Dict[str, str]]:
+        """
+        Find the first row whose value in `column` satisfies `matches` without downloading the whole sheet
+        
+        Only the header row and the search column are fetched; the matching row is then read on its own.
+        Returns the row as a header -> value dictionary, or None if nothing matched.
+        """
+        try:
+            if not self.service:
+                logger.error("Google Sheets service not initialized")
+                return None
+            
+            # Fetch the header row and the search column in one call
+            sheet = self.service.spreadsheets()
+            result = sheet.values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=[
+                    self.normalize_range(f"{sheet_name}!1:1"),
+                    self.normalize_range(f"{sheet_name}!{column}:{column}")
+                ]
+            ).execute()
+            
+            header_range, column_range = result.get('valueRanges', [{}, {}])
+            header = (header_range.get('values') or [[]])[0]
+            column_values = column_range.get('values', [])
+            
+            # Skip the header cell; Sheets rows are 1-indexed
+            row_number = None
+            for i, cell in enumerate(column_values[1:], start=2):
+                if cell and matches(str(cell[0])):
+                    row_number = i
+                    break
+            
+            if row_number is None:
+                return None
+            
+            # Read just the matching row
+            row_result = sheet.values().get(
+                spreadsheetId=spreadsheet_id,
+                range=self.normalize_range(f"{sheet_name}!A{row_number}:Z{row_number}")
+            ).execute()
+            row = (row_result.get('values') or [[]])[0]
+            
+            return dict(zip(header, row))
+            
+        except HttpError as error:
+            logger.error(f"Google Sheets API error: {error}")
+            return None
+        except Exception as e:
+            logger.error(f"Error finding row: {e}")
+            return None
+    
     async def update_cell(self, spreadsheet_id: str, sheet_name: str, row: int, col: int, value: Any) -> bool:
         """Update a specific cell in a Google Sheet"""
         try:
@@ -93,8 +152,7 @@ class GoogleSheetsService:
                 return False
             
             # Convert row, col to A1 notation
-            col_letter = chr(64 + col) if col <= 26 else chr(64 + col // 26) + chr(64 + col % 26)
-            range_name = f"{sheet_name}!{col_letter}{row}"
+            range_name = self.cell_range(sheet_name, row, col)
             
             # Prepare request body
             body = {
@@ -120,6 +178,42 @@ class GoogleSheetsService:
             logger.error(f"Error updating cell: {e}")
             return False
     
+    async def batch_update_cells(self, spreadsheet_id: str, sheet_name: str, cells: List[Tuple[int, int, Any]]) -> bool:
+        """Update several cells in a Google Sheet with a single batchUpdate request"""
+        try:
+            if not self.service:
+                logger.error("Google Sheets service not initialized")
+                return False
+            
+            if not cells:
+                return True
+            
+            # One value range per (row, col, value) tuple
+            body = {
+                'valueInputOption': 'USER_ENTERED',
+                'data': [
+                    {'range': self.cell_range(sheet_name, row, col), 'values': [[value]]}
+                    for row, col, value in cells
+                ]
+            }
+            
+            # Call the Sheets API
+            sheet = self.service.spreadsheets()
+            result = sheet.values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body=body
+            ).execute()
+            
+            logger.info(f"{result.get('totalUpdatedCells', len(cells))} cells updated in {sheet_name}")
+            return True
+            
+        except HttpError as error:
+            logger.error(f"Google Sheets API error: {error}")
+            return False
+        except Exception as e:
+            logger.error(f"Error batch updating cells: {e}")
+            return False
+    
     async def append_row(self, spreadsheet_id: str, sheet_name: str, values: List[Any]) -> bool:
         """Append a row to a Google Sheet"""
         try:
@@ -46,6 +46,22 @@ def get_google_credentials():
         logger.error(f"Error loading Google credentials: {str(e)}")
         return None
 
+# Built API clients keyed by (api name, version). Building a client loads credentials and the
+# discovery document and opens a new HTTP connection, so each one is created once and reused.
+_google_services = {}
+
+def get_google_service(api_name: str, version: str):
+    """Return a cached Google API client, building it on first use"""
+    key = (api_name, version)
+    service = _google_services.get(key)
+    if service is None:
+        credentials = get_google_credentials()
+        if not credentials:
+            return None
+        service = build(api_name, version, credentials=credentials, cache_discovery=False)
+        _google_services[key] = service
+    return service
+
 async def update_gsuite_resources(task_result: Dict) -> bool:
     """
     Update Google Workspace resources based on task results
@@ -92,11 +108,9 @@ async def update_calendar_for_leave(leave_details: Dict) -> Optional[str]:
         Calendar event ID or None if failed
     """
     try:
-        credentials = get_google_credentials()
-        if not credentials:
+        service = get_google_service('calendar', 'v3')
+        if not service:
             return None
-            
-        service = build('calendar', 'v3', credentials=credentials)
         
         # Get employee details
         employee_name = leave_details.get("employee_name", "Employee")
@@ -146,11 +160,9 @@ async def update_leave_tracking_spreadsheet(leave_details: Dict) -> bool:
         Boolean indicating success
     """
     try:
-        credentials = get_google_credentials()
-        if not credentials:
+        service = get_google_service('sheets', 'v4')
+        if not service:
             return False
-            
-        service = build('sheets', 'v4', credentials=credentials)
         
         # Get spreadsheet ID from environment
         spreadsheet_id = os.getenv("LEAVE_TRACKING_SPREADSHEET_ID")
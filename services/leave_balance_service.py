@@ -0,0 +1,113 @@
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import Date, Integer, cast, extract, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.models import LeaveBalanceCache, LeaveRequest
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Inclusive length of a leave in days, computed by the database (Postgres date subtraction yields an integer)
+LEAVE_DAYS = cast(LeaveRequest.end_date, Date) - cast(LeaveRequest.start_date, Date) + 1
+
+def leave_days(leave_request: LeaveRequest) -> int:
+    """Inclusive length of a leave in whole days, matching LEAVE_DAYS"""
+    return (leave_request.end_date - leave_request.start_date).days + 1
+
+def adjust_leave_balance(db: Session, user_id: int, leave_request: LeaveRequest, direction: int = 1) -> None:
+    """
+    Add (or with direction=-1, remove) a leave's days to the cached balance for its year and type
+    
+    Args:
+        db: Database session; the change is committed with the caller's status transition
+        user_id: Owner of the leave
+        leave_request: Leave being approved or cancelled
+        direction: 1 when the leave becomes approved, -1 when an approved leave is withdrawn
+    """
+    key = (user_id, leave_request.start_date.year, leave_request.leave_type)
+    _add_usage(db, key, direction * leave_days(leave_request))
+
+def adjust_leave_balances(db: Session, approved: Iterable) -> None:
+    """
+    Add a batch of newly approved leaves to the cached balances, one change per (user, year, type)
+    
+    Args:
+        db: Database session; the change is committed with the caller's status transition
+        approved: Rows with employee_id, leave_type, start_date and end_date
+    """
+    deltas = defaultdict(float)
+    for leave in approved:
+        deltas[(leave.employee_id, leave.start_date.year, leave.leave_type)] += leave_days(leave)
+    for key, delta in deltas.items():
+        _add_usage(db, key, delta)
+
+def _add_usage(db: Session, key: Tuple[int, int, str], delta: float) -> None:
+    """Apply delta used days to the cache row for key, creating it if needed"""
+    # A single upsert incrementing in SQL, so concurrent approvals for the same key neither
+    # overwrite each other nor race to create the row
+    stmt = pg_insert(LeaveBalanceCache).values(user_id=key[0], year=key[1], leave_type=key[2], used_days=delta)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[LeaveBalanceCache.user_id, LeaveBalanceCache.year, LeaveBalanceCache.leave_type],
+        set_={"used_days": LeaveBalanceCache.used_days + stmt.excluded.used_days, "updated_at": func.now()}
+    ))
+
+def get_used_by_type(db: Session, user_id: int, year: int) -> Dict[str, float]:
+    """Approved leave days used per leave type in a year, read from the balance cache"""
+    rows = db.query(LeaveBalanceCache.leave_type, LeaveBalanceCache.used_days).filter(
+        LeaveBalanceCache.user_id == user_id,
+        LeaveBalanceCache.year == year
+    ).all()
+    return {leave_type: float(used_days or 0) for leave_type, used_days in rows}
+
+def rebuild_all(db: Session) -> int:
+    """
+    Recompute the whole balance cache from approved leave requests
+    
+    Used to bootstrap the table or repair drift; leaves are counted in the year they start.
+    
+    Args:
+        db: Database session
+        
+    Returns:
+        Number of cache rows written
+    """
+    year = cast(extract("year", LeaveRequest.start_date), Integer)
+    usage = select(
+        LeaveRequest.employee_id,
+        year,
+        LeaveRequest.leave_type,
+        func.sum(LEAVE_DAYS)
+    ).where(
+        LeaveRequest.status == "approved"
+    ).group_by(LeaveRequest.employee_id, year, LeaveRequest.leave_type)
+    
+    db.query(LeaveBalanceCache).delete()
+    result = db.execute(
+        insert(LeaveBalanceCache).from_select(["user_id", "year", "leave_type", "used_days"], usage)
+    )
+    db.commit()
+    
+    logger.info(f"Rebuilt leave balance cache with {result.rowcount} rows")
+    return result.rowcount
+
+def seed_leave_balances(db: Session) -> None:
+    """
+    Backfill the balance cache from existing approvals if it is empty, e.g. on first deploy
+    
+    Args:
+        db: Database session
+    """
+    if db.query(LeaveBalanceCache.user_id).first() is not None:
+        return
+    
+    try:
+        rebuild_all(db)
+    except IntegrityError:
+        # Another worker seeded the table at the same time
+        db.rollback()
+        logger.info("Leave balance cache was seeded concurrently by another worker")
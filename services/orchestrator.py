@@ -1,7 +1,10 @@
 from typing import Dict, List, Optional, Tuple
 import logging
+import asyncio
 from enum import Enum
 import json
+import re
+from pydantic import ValidationError
 
 # Import agent modules
 from agents.leave_manager import LeaveManagerAgent
@@ -11,8 +14,10 @@ from agents.general_hr_manager import GeneralHRAgent
 # from agents.payroll_assistant import PayrollAssistantAgent
 # from agents.onboarding_agent import OnboardingAgent
 
-from llms.gemini_client import get_gemini_response
-from services.context_service import store_chat_context
+from llms.gemini_client import GEMINI_ERROR_RESPONSE, get_gemini_response, response_schema_for
+from models.schemas import IntentClassification
+from processors.json_processor import json_block
+from services.context_service import store_chat_context_in_background
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +29,15 @@ class AgentType(Enum):
     # PAYROLL_ASSISTANT = "payroll_assistant"
     # ONBOARDING = "onboarding"
 
+INTENT_SCHEMA = response_schema_for(IntentClassification)
+
+# Agents that can change state (submit, approve or cancel leave; update employee records). Their reply
+# describes what they did, so it is never swapped for a low-confidence backup answer
+SIDE_EFFECT_AGENTS = frozenset({AgentType.LEAVE_MANAGER, AgentType.EMPLOYEE_MANAGER})
+
+# HR admin commands that always go to the leave manager, whatever the classifier would say
+HR_OVERRIDE_RE = re.compile(r"force leave|override|admin action", re.I)
+
 class Orchestrator:
     def __init__(self):
         # Initialize all agent instances
@@ -36,74 +50,102 @@ class Orchestrator:
             # AgentType.ONBOARDING: OnboardingAgent(),
         }
         
-    async def determine_intent(self, message: str, user_info: Dict, context: str) -> Tuple[AgentType, float]:
-        """Determine the user's intent and route to appropriate agent"""
+    async def determine_intent(self, message: str, user_info: Dict, context: str) -> Tuple[AgentType, float, Optional[str]]:
+        """Determine the user's intent and, for general questions, draft the answer in the same call"""
         
-        # Use LLM to determine intent
+        # Fixed instructions go first so every classifier prompt shares the same prefix; only the
+        # caller's role matters for routing, not the rest of their profile
         prompt = f"""
         As an HRMS intent classifier, determine which specialized HR agent should handle this request.
         
-        USER PROFILE:
-        {json.dumps(user_info)}
+        Based on the message, classify the intent into exactly ONE of these categories:
+        - leave_manager: For leave requests, approvals, leave balance inquiries
+        - employee_manager: For requests to find or extract or change specific information of someone from HR records, 
+        - general_hr: For general HR inquiries or anything that doesn't fit above categories
+        
+        Respond with JSON containing:
+        - intent: the category name
+        - confidence: how sure you are of the category, from 0 to 1
+        - draft_response: if the intent is general_hr or your confidence is below 0.6, a helpful, concise
+          answer to the message as an HR assistant (advise contacting HR directly for sensitive issues such as
+          harassment, compensation disputes or termination); otherwise null
+        
+        USER: role={user_info.get("role", "employee")}
         
         CONVERSATION CONTEXT:
         # {(context if context else [])}
         
         USER MESSAGE:
         {message}
-        
-        Based on the message, classify the intent into exactly ONE of these categories:
-        - leave_manager: For leave requests, approvals, leave balance inquiries
-        - employee_manager: For requests to find or extract or change specific information of someone from HR records, 
-        - general_hr: For general HR inquiries or anything that doesn't fit above categories
-        
-        Your response should be ONLY the category name without any additional text or explanation.
         """
         
         try:
-            intent_response = await get_gemini_response(prompt, user_info.get("id", "unknown"), "system")
-            intent = intent_response.strip().lower()
+            intent_response = await get_gemini_response(
+                prompt, user_info.get("id", "unknown"), "system", response_schema=INTENT_SCHEMA
+            )
+            if intent_response == GEMINI_ERROR_RESPONSE:
+                return AgentType.GENERAL_HR, 0.3, None
+            
+            classification = IntentClassification.model_validate_json(json_block(intent_response))
+            intent = (classification.intent or "").strip().lower()
+            confidence = classification.confidence if classification.confidence is not None else 0.9
             
             # Map the text response to enum
             for agent_type in AgentType:
                 if agent_type.value == intent:
-                    logger.info(f"Intent determined as {agent_type.value} for message: {message[:50]}...")
-                    return agent_type, 0.9  # Confidence score
+                    logger.info(f"Intent determined as {agent_type.value} ({confidence:.2f}) for message: {message[:50]}...")
+                    return agent_type, confidence, classification.draft_response
                     
             # Default to general HR if no match
             logger.warning(f"Could not determine specific intent, defaulting to general HR for: {message[:50]}...")
-            return AgentType.GENERAL_HR, 0.5
+            return AgentType.GENERAL_HR, 0.5, classification.draft_response
+            
+        except (json.JSONDecodeError, ValidationError):
+            logger.error(f"Failed to parse intent classification JSON: {intent_response}")
+            return AgentType.GENERAL_HR, 0.3, None
             
         except Exception as e:
             logger.error(f"Error determining intent: {e}")
-            return AgentType.GENERAL_HR, 0.3
+            return AgentType.GENERAL_HR, 0.3, None
     
     async def process_message(self, message: str, user_id: str, user_info: Dict, role: str, context: str) -> str:
         """Main orchestration method to process incoming messages"""
         
-        # Determine user intent
-        agent_type, confidence = await self.determine_intent(message, user_info, context)
-        
-        # If HR admin with specific role commands, override intent detection
-        if role == "hr" and any(keyword in message.lower() for keyword in ["force leave", "override", "admin action"]):
-            agent_type = AgentType.LEAVE_MANAGER
+        # HR admin commands are routed without asking the classifier
+        if role == "hr" and HR_OVERRIDE_RE.search(message):
+            agent_type, confidence = AgentType.LEAVE_MANAGER, 1.0
             logger.info(f"Intent overridden to {agent_type.value} based on HR admin command")
+            response = await self.agents[agent_type].process(message, user_id, user_info, role, context)
+            await store_chat_context_in_background(user_id, message, response)
+            return response
+        
+        # Determine user intent; general questions come back already answered
+        agent_type, confidence, draft_response = await self.determine_intent(message, user_info, context)
         
         # Get appropriate agent
         agent = self.agents[agent_type]
         
+        # Low-confidence answers from read-only agents are checked against a general HR backup
+        use_backup = confidence < 0.6 and agent_type != AgentType.GENERAL_HR and agent_type not in SIDE_EFFECT_AGENTS
+        
         # Process through the selected agent
-        response = await agent.process(message, user_id, user_info, role, context)
+        if agent_type == AgentType.GENERAL_HR:
+            response = await agent.process(message, user_id, user_info, role, context, draft_response=draft_response)
+        elif use_backup:
+            # For low confidence scenarios, get a backup response at the same time rather than afterwards
+            response, backup_response = await asyncio.gather(
+                agent.process(message, user_id, user_info, role, context),
+                self.agents[AgentType.GENERAL_HR].process(
+                    message, user_id, user_info, role, context, draft_response=draft_response
+                )
+            )
+        else:
+            response = await agent.process(message, user_id, user_info, role, context)
         
-        # Store interaction in context
-        store_chat_context(user_id, message, response)
+        # Store interaction in context without holding up the reply
+        await store_chat_context_in_background(user_id, message, response)
         
-        # For low confidence scenarios, get a backup response
-        if confidence < 0.6 and agent_type != AgentType.GENERAL_HR:
-            backup_response = await self.agents[AgentType.GENERAL_HR].process(
-                message, user_id, user_info, role, context
-            )
-            
+        if use_backup:
             # Use LLM to decide the best response
             final_response = await self._select_best_response(
                 message, response, backup_response, agent_type.value, "general_hr", confidence
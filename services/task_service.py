@@ -1,17 +1,29 @@
 import logging
 from typing import Dict, Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
+from sqlalchemy import func, insert, or_, update
 from sqlalchemy.orm import Session
 import json
 
-from database.db import SessionLocal
+from database.pgDb import SessionLocal
 from models.models import User, LeaveRequest, TaskRecord
 from processors.message_processor import extract_task_details
+from services.leave_balance_service import adjust_leave_balance
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Date shapes accepted by parse_date and the strptime formats to try for each, in order;
+# day-first wins when a slash date is ambiguous
+_DATE_FORMATS = [
+    (re.compile(r"\d{4}-\d{1,2}-\d{1,2}"), ("%Y-%m-%d",)),
+    (re.compile(r"\d{1,2}/\d{1,2}/\d{4}"), ("%d/%m/%Y", "%m/%d/%Y")),
+    (re.compile(r"\d{1,2}-\d{1,2}-\d{4}"), ("%d-%m-%Y",)),
+    (re.compile(r"\d{1,2} [A-Za-z]+ \d{4}"), ("%d %B %Y",)),
+    (re.compile(r"[A-Za-z]+ \d{1,2}, \d{4}"), ("%B %d, %Y",)),
+]
+
 def process_task_request(message: str, user_id: str) -> Optional[Dict]:
     """
     Process HR-specific task requests
@@ -30,25 +42,24 @@ def process_task_request(message: str, user_id: str) -> Optional[Dict]:
     if not task_details["task_type"]:
         return None
         
-    db = SessionLocal()
-    try:
-        # Get user
-        hr_user = db.query(User).filter(User.phone_number == user_id).first()
-        
-        # Process based on task type
-        if task_details["task_type"] == "leave_approval":
-            result = process_leave_approval(db, task_details, hr_user)
-            return result
+    # The session is closed (and any unfinished transaction rolled back) when the block exits
+    with SessionLocal() as db:
+        try:
+            # Get user
+            hr_user = db.query(User).filter(User.phone_number == user_id).first()
             
-        # Add other task types as needed
-        
-        return None
-        
-    except Exception as e:
-        logger.error(f"Error processing task request: {str(e)}")
-        return None
-    finally:
-        db.close()
+            # Process based on task type
+            if task_details["task_type"] == "leave_approval":
+                result = process_leave_approval(db, task_details, hr_user)
+                return result
+                
+            # Add other task types as needed
+            
+            return None
+            
+        except Exception as e:
+            logger.error(f"Error processing task request: {str(e)}")
+            return None
 
 def process_leave_approval(db: Session, task_details: Dict, hr_user: User) -> Dict:
     """
@@ -76,50 +87,58 @@ def process_leave_approval(db: Session, task_details: Dict, hr_user: User) -> Di
             result["summary"] = "Employee not specified in request"
             return result
             
-        # Try to find employee by name, username, or ID
-        employee = (
-            db.query(User)
-            .filter(
-                (User.username == employee_identifier) | 
-                (User.email.like(f"%{employee_identifier}%")) |
-                (User.id == employee_identifier if employee_identifier.isdigit() else False)
-            )
-            .first()
-        )
-        
-        if not employee:
-            result["summary"] = f"Employee '{employee_identifier}' not found"
-            return result
+        # Match the employee by username, email or ID
+        employee_filter = or_(User.username == employee_identifier, User.email.ilike(f"%{employee_identifier}%"))
+        if employee_identifier.isdigit():
+            employee_filter = or_(employee_filter, User.id == int(employee_identifier))
             
-        # Find pending leave request
-        date_range = task_details.get("date_range", {})
-        
-        query = db.query(LeaveRequest).filter(
-            LeaveRequest.employee_id == employee.id,
+        # Find the employee and their pending leave request in one query
+        query = db.query(User, LeaveRequest).join(
+            LeaveRequest, LeaveRequest.employee_id == User.id
+        ).filter(
+            employee_filter,
             LeaveRequest.status == "pending"
         )
         
-        # Add date filtering if available
-        if date_range and date_range.get("start"):
-            # Parse dates (simplified here - would need proper date parsing in production)
-            query = query.filter(LeaveRequest.start_date.like(f"%{date_range['start']}%"))
+        # Add date filtering if available; a day range keeps the (employee_id, status, start_date) index usable
+        date_range = task_details.get("date_range") or {}
+        start = parse_date(date_range["start"]) if date_range.get("start") else None
+        if start:
+            query = query.filter(LeaveRequest.start_date >= start, LeaveRequest.start_date < start + timedelta(days=1))
             
-        if date_range and date_range.get("end"):
-            query = query.filter(LeaveRequest.end_date.like(f"%{date_range['end']}%"))
+        end = parse_date(date_range["end"]) if date_range.get("end") else None
+        if end:
+            query = query.filter(LeaveRequest.end_date >= end, LeaveRequest.end_date < end + timedelta(days=1))
             
-        leave_request = query.first()
-        
-        if not leave_request:
-            result["summary"] = f"No pending leave request found for {employee.username}"
+        match = query.order_by(LeaveRequest.start_date).first()
+        
+        if not match:
+            # Only on a miss, find out which part failed for the summary
+            employee = db.query(User).filter(employee_filter).first()
+            if not employee:
+                result["summary"] = f"Employee '{employee_identifier}' not found"
+            else:
+                result["summary"] = f"No pending leave request found for {employee.username}"
             return result
             
+        employee, leave_request = match
+            
         # Process approval
-        leave_request.status = "approved"
-        leave_request.approved_by = hr_user.id
-        leave_request.approved_at = datetime.now()
+        # Approve only if still pending, so a concurrent approval of the same request can't apply twice
+        approved = db.execute(
+            update(LeaveRequest)
+            .where(LeaveRequest.id == leave_request.id, LeaveRequest.status == "pending")
+            .values(status="approved", approved_by=hr_user.id, approved_at=func.now())
+            .returning(LeaveRequest.id)
+        ).first()
+        if not approved:
+            result["summary"] = f"Leave request #{leave_request.id} for {employee.username} was already processed"
+            return result
+            
+        adjust_leave_balance(db, employee.id, leave_request)
         
-        # Create task record
-        task_record = TaskRecord(
+        # Record the task in the same transaction
+        db.execute(insert(TaskRecord).values(
             task_type="leave_approval",
             user_id=hr_user.id,
             details={
@@ -128,10 +147,8 @@ def process_leave_approval(db: Session, task_details: Dict, hr_user: User) -> Di
                 "action": "approved"
             },
             status="completed",
-            completed_at=datetime.now()
-        )
-        
-        db.add(task_record)
+            completed_at=func.now()
+        ))
         db.commit()
         
         # Prepare response
@@ -141,8 +158,8 @@ def process_leave_approval(db: Session, task_details: Dict, hr_user: User) -> Di
             "leave_id": leave_request.id,
             "employee_id": employee.id,
             "employee_name": employee.username,
-            "start_date": str(leave_request.start_date),
-            "end_date": str(leave_request.end_date),
+            "start_date": leave_request.start_date.isoformat(),
+            "end_date": leave_request.end_date.isoformat(),
             "leave_type": leave_request.leave_type,
             "calendar_update_required": True
         }
@@ -164,15 +181,14 @@ def parse_date(date_str: str) -> Optional[datetime]:
     Returns:
         Datetime object or None if parsing fails
     """
-    date_formats = [
-        "%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", 
-        "%d-%m-%Y", "%d %B %Y", "%B %d, %Y"
-    ]
-    
-    for fmt in date_formats:
-        try:
-            return datetime.strptime(date_str, fmt)
-        except ValueError:
-            continue
+    # Pick the candidate formats by shape first, so strptime runs on formats that can actually match
+    for pattern, formats in _DATE_FORMATS:
+        if pattern.fullmatch(date_str):
+            for fmt in formats:
+                try:
+                    return datetime.strptime(date_str, fmt)
+                except ValueError:
+                    continue
+            return None
             
-    return None
\ No newline at end of file
+    return None
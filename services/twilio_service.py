@@ -1,4 +1,5 @@
 import logging
+import threading
 from typing import Optional
 import os
 from twilio.rest import Client
@@ -7,14 +8,29 @@ from twilio.base.exceptions import TwilioRestException
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# One client (and its HTTP connection pool) is shared by every send
+_client: Optional[Client] = None
+_client_lock = threading.Lock()
+
 # Initialize Twilio client
 def get_twilio_client() -> Optional[Client]:
     """
-    Get Twilio client instance
+    Get the shared Twilio client instance, creating it on first use
     
     Returns:
         Twilio Client instance or None if initialization fails
     """
+    global _client
+    if _client is not None:
+        return _client
+    
+    with _client_lock:
+        if _client is None:
+            _client = _create_twilio_client()
+    return _client
+
+def _create_twilio_client() -> Optional[Client]:
+    """Build a Twilio client from the environment credentials"""
     try:
         account_sid = os.getenv("TWILIO_ACCOUNT_SID")
         auth_token = os.getenv("TWILIO_AUTH_TOKEN")
@@ -59,6 +75,7 @@ def send_whatsapp_message(to_number: str, message: str) -> bool:
         if len(message) > 1500:
             chunks = [message[i:i+1500] for i in range(0, len(message), 1500)]
             
+            # Sent one after another so the parts arrive in order; the shared client reuses its connection
             for chunk in chunks:
                 client.messages.create(
                     body=chunk,